@@ -0,0 +1,6 @@
+"""
+Merge MANGO runs with the same description and attach the environmental information to them.
+
+The command line interface is `python -m mango_merge` (see cli.py), the heavy modules (pandas, ROOT, uproot)
+are imported only by the subcommands that need them.
+"""
@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+from .history import MANGO_SENSOR_COLUMNS, read_mhist
+from . import runlog, logbook
+from .merging import annotate_root_file, annotate_source_files, execute_merge_jobs
+
+def generate_runs(folder, n_runs, events_per_run, first_run=1, seed=0):
+    """
+    Writes n_runs synthetic reco_runN_3D.root files with an Events TTree.
+
+    Parameters:
+    - folder: Folder where the files are written.
+    - n_runs: Number of runs.
+    - events_per_run: Number of entries of each Events tree.
+    - first_run: Number of the first run.
+    - seed: Seed of the random generator.
+
+    Returns:
+    - The list of run numbers.
+    """
+    import uproot
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+    run_numbers = list(range(first_run, first_run + n_runs))
+    for run_number in run_numbers:
+        branches = {
+            'run': np.full(events_per_run, run_number, dtype=np.int32),
+            'event': np.arange(events_per_run, dtype=np.int32),
+            'sc_integral': rng.exponential(1000.0, events_per_run).astype(np.float32),
+            'sc_xmean': rng.uniform(0, 2304, events_per_run).astype(np.float32),
+            'sc_ymean': rng.uniform(0, 2304, events_per_run).astype(np.float32),
+        }
+        with uproot.recreate(os.path.join(folder, f"reco_run{run_number}_3D.root")) as root_file:
+            # A TTree like the real reco files, assigning the dictionary would write an RNTuple
+            events = root_file.mktree("Events", {name: values.dtype for name, values in branches.items()})
+            events.extend(branches)
+    return run_numbers
+
+def generate_runlog(path, run_numbers, start, run_length=600, n_positions=4, drift_fields=(300, 500, 700)):
+    """
+    Writes a synthetic Runlog CSV, runs one after the other and spread over the source positions and drift fields.
+
+    Parameters:
+    - path: Path of the CSV.
+    - run_numbers: List of run numbers.
+    - start: Start time of the first run.
+    - run_length: Length of each run in seconds.
+    - n_positions: Number of source positions.
+    - drift_fields: Drift fields used.
+    """
+    starts = pd.Timestamp(start) + pd.to_timedelta(np.arange(len(run_numbers)) * run_length, unit='s')
+    pd.DataFrame({
+        'run_number': run_numbers,
+        'source_position': [i % n_positions for i in range(len(run_numbers))],
+        'DRIFT_V': [drift_fields[(i // n_positions) % len(drift_fields)] for i in range(len(run_numbers))],
+        'start_time': starts.strftime("%Y-%m-%d %H:%M:%S"),
+        'stop_time': (starts + pd.Timedelta(seconds=run_length - 1)).strftime("%Y-%m-%d %H:%M:%S"),
+    }).to_csv(path, index=False)
+
+def generate_history(path, start, n_samples, period=10, seed=0):
+    """
+    Writes a synthetic mhist output (8 header lines, then tab separated samples).
+
+    Parameters:
+    - path: Path of the file.
+    - start: Time of the first sample.
+    - n_samples: Number of samples.
+    - period: Seconds between two samples.
+    - seed: Seed of the random generator.
+    """
+    rng = np.random.default_rng(seed)
+    times = pd.Timestamp(start) + pd.to_timedelta(np.arange(n_samples) * period, unit='s')
+    base = np.array([295.0, 97000.0, 40.0, 295.0, 97000.0, 40.0])
+    values = base + rng.normal(0, 1, (n_samples, len(base))).cumsum(axis=0) * 0.01
+    with open(path, 'w') as f:
+        f.write(''.join(f"# mhist header line {i}\n" for i in range(8)))
+        for time_string, row in zip(times.strftime('%a %b %d %H:%M:%S %Y'), values):
+            f.write(time_string + '\t\t' + '\t'.join(f"{value:.3f}" for value in row) + '\n')
+
+def generate_logbook(path, run_numbers, runs_per_row=10):
+    """
+    Writes a synthetic excel logbook, one ED row every runs_per_row runs.
+
+    Parameters:
+    - path: Path of the xlsx file.
+    - run_numbers: List of run numbers.
+    - runs_per_row: Number of runs in each row.
+    """
+    rows = []
+    for i in range(0, len(run_numbers), runs_per_row):
+        chunk = run_numbers[i:i + runs_per_row]
+        rows.append({'Run number start': chunk[0], 'Run number end': chunk[-1], 'comments': 'ED scan',
+                     'He/CF4 ratio': '60/40/0', 'Requested_Drift_field_V_cm': 500,
+                     'Position of source [hole]': (i // runs_per_row) % 4,
+                     'Sensor inside [T;P;H;--] [K,Pa,%,-]': '295;97000;40;1'})
+    pd.DataFrame(rows).to_excel(path, index=False)
+
+def timed(report, stage, function, *args, **kwargs):
+    """
+    Calls function and stores its wall time in seconds in report['stages'][stage].
+
+    Returns:
+    - What function returns.
+    """
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    report['stages'][stage] = time.perf_counter() - start
+    return result
+
+def git_commit():
+    """
+    Returns the commit of the repository the package is in, None if it cannot be found.
+    """
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+def run_benchmark(n_runs=50, events_per_run=1000, history_hours=24, workdir=None, workers=1, backend='hadd', compression=None):
+    """
+    Generates a synthetic dataset and times each stage of the pipeline on it: logbook and Runlog parsing,
+    grouping, environment join, annotation (EnvParam with uproot, OtherParam with PyROOT) and merging.
+    The OtherParam annotation is skipped if ROOT cannot be imported, the merge if the backend is not available.
+
+    Parameters:
+    - n_runs: Number of runs.
+    - events_per_run: Number of events of each run.
+    - history_hours: Length of the MIDAS history, one sample every 10 seconds.
+    - workdir: Folder of the synthetic dataset (default a temporary folder, removed at the end).
+    - workers: Number of parallel merge jobs and annotation processes.
+    - backend: Merge backend, 'hadd' or 'root'.
+    - compression: Compression of the merged files, see compression_setting.
+
+    Returns:
+    - The report dictionary: configuration, commit, environment and the time of each stage in seconds.
+    """
+    report = {'config': {'n_runs': n_runs, 'events_per_run': events_per_run, 'history_hours': history_hours,
+                         'workers': workers, 'backend': backend, 'compression': compression},
+              'commit': git_commit(), 'python': platform.python_version(), 'pandas': pd.__version__,
+              'stages': {}, 'skipped': {}}
+    cleanup = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix='mango_bench_')
+    source, target = os.path.join(workdir, 'source'), os.path.join(workdir, 'target')
+    runlog_path, history_path = os.path.join(workdir, 'runlog.csv'), os.path.join(workdir, 'history_output.csv')
+    logbook_path = os.path.join(workdir, 'logbook.xlsx')
+    try:
+        # Synthetic inputs, not timed
+        start = pd.Timestamp('2024-07-05 00:00:00')
+        run_numbers = generate_runs(source, n_runs, events_per_run)
+        generate_runlog(runlog_path, run_numbers, start + pd.Timedelta(minutes=5),
+                        run_length=max(2, int(history_hours * 3600 / max(n_runs, 1))) - 1)
+        generate_history(history_path, start, int(history_hours * 360))
+        generate_logbook(logbook_path, run_numbers)
+
+        logbook_df = timed(report, 'logbook_parsing', logbook.load_logbook, logbook_path, cache_dir=False)
+        timed(report, 'logbook_selection', logbook.select_runs, logbook_df)
+        runs_df = timed(report, 'runlog_parsing', runlog.read_runlog, runlog_path)
+        grouped = timed(report, 'grouping', runlog.group_runs, runs_df)
+        jobs = runlog.generate_hadd_jobs(grouped, source, target)
+        history = timed(report, 'history_parsing', read_mhist, history_path, MANGO_SENSOR_COLUMNS, cache_dir=False)
+        env_matched = timed(report, 'environment_join', runlog.join_nearest_env_data, runs_df, history.reset_index(), 'Time',
+                            start_format="%Y-%m-%d %H:%M:%S")
+        timed(report, 'window_statistics', runlog.window_env_stats, runs_df, history.reset_index(), 'Time',
+              time_format="%Y-%m-%d %H:%M:%S")
+
+        # The EnvParam friend tree written with uproot by the logbook subcommand
+        def annotate():
+            for index, row in runs_df.iterrows():
+                annotate_root_file(os.path.join(source, f"reco_run{row['run_number']}_3D.root"), env_matched.loc[index])
+        timed(report, 'envparam_annotation', annotate)
+
+        # The OtherParam tree written with PyROOT by the runlog subcommand, with its pool of workers
+        try:
+            import ROOT  # noqa: F401
+        except ImportError:
+            report['skipped']['otherparam_annotation'] = 'ROOT not found'
+        else:
+            tasks = [(os.path.join(source, f"reco_run{row['run_number']}_3D.root"),
+                      {**env_matched.loc[index].to_dict(), 'DRIFT_V': row['DRIFT_V'], 'HOLE_number': row['source_position']})
+                     for index, row in runs_df.iterrows()]
+            errors = timed(report, 'otherparam_annotation', annotate_source_files, tasks, workers=workers)
+            if errors:
+                raise RuntimeError(f"Cannot annotate {errors[0][0]}: {errors[0][1]}")
+
+        os.makedirs(target, exist_ok=True)
+        if backend == 'hadd' and shutil.which('hadd') is None:
+            report['skipped']['merging'] = 'hadd not found'
+        else:
+            try:
+                timed(report, 'merging', execute_merge_jobs, jobs, workers=workers, backend=backend,
+                      compression=compression)
+            except ImportError as e:
+                report['skipped']['merging'] = str(e)
+        report['stages']['total'] = sum(report['stages'].values())
+    finally:
+        if cleanup:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+def run(args):
+    """
+    Runs the benchmark subcommand and writes the JSON report.
+
+    Parameters:
+    - args: The parsed command line arguments.
+    """
+    report = run_benchmark(args.runs, args.events, args.hours, args.workdir, args.workers, args.backend,
+                           args.compression)
+    for stage, seconds in report['stages'].items():
+        print(f"{stage:>20}: {seconds:8.3f} s")
+    for stage, reason in report['skipped'].items():
+        print(f"{stage:>20}: skipped ({reason})")
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f"Report written to {args.output}")
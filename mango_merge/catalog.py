@@ -0,0 +1,225 @@
+import os
+import re
+import glob
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from .merging import tree_entries
+
+RUN_FILE_PATTERN = re.compile(r'reco_run(\d+)_3D\.root$')
+# Names of the logbook columns in the catalog
+LOGBOOK_CATALOG_COLUMNS = {'Run number start': 'start_run', 'Run number end': 'stop_run', 'comments': 'comments',
+                           'Requested_Drift_field_V_cm': 'drift_field', 'Position of source [hole]': 'hole',
+                           'helium': 'helium', 'CF4': 'cf4', 'SF6': 'sf6', 'Temperature (K)': 'temperature',
+                           'Pressure (Pa)': 'pressure', 'Humidity (%)': 'humidity', 'VOC (-)': 'voc'}
+# Indexes of the runs table, created for the columns that exist
+RUN_INDEXES = {'start': ['start_time'], 'drift': ['DRIFT_V'], 'position': ['source_position'],
+               'logbook_drift': ['drift_field'], 'hole': ['hole'], 'gas': ['helium', 'cf4', 'sf6']}
+DEFAULT_GROUP_BY = 'source_position,DRIFT_V'
+
+def table_frame(connection, table):
+    """
+    Reads a whole table of the catalog, an empty DataFrame if it does not exist yet.
+
+    Parameters:
+    - connection: The sqlite3 connection to the catalog.
+    - table: Name of the table.
+    """
+    exists = connection.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+    return pd.read_sql(f'SELECT * FROM "{table}"', connection) if exists else pd.DataFrame()
+
+def runlog_table(runlog_path):
+    """
+    Reads the Runlog for the catalog, with the start and stop times written as 'YYYY-MM-DD HH:MM:SS'
+    so they can be compared as text in the queries.
+
+    Parameters:
+    - runlog_path: Path to the Runlog CSV.
+
+    Returns:
+    - The Runlog DataFrame, one row per run.
+    """
+    from .runlog import read_runlog
+    df = read_runlog(runlog_path).drop(columns=['HOLE_number'])
+    for column in ['start_time', 'stop_time']:
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column], errors='coerce').dt.strftime('%Y-%m-%d %H:%M:%S')
+    return df.drop_duplicates('run_number', keep='last')
+
+def logbook_table(logbook_path):
+    """
+    Reads the excel logbook for the catalog, with short column names (see LOGBOOK_CATALOG_COLUMNS).
+
+    Parameters:
+    - logbook_path: Path to the excel logbook.
+
+    Returns:
+    - The logbook DataFrame, one row per run range.
+    """
+    from .logbook import load_logbook
+    df = load_logbook(logbook_path).rename(columns=LOGBOOK_CATALOG_COLUMNS)
+    df = df.dropna(subset=['start_run', 'stop_run'])
+    return df.astype({'start_run': int, 'stop_run': int, 'comments': object})
+
+def files_table(source_folder, previous=None, workers=1):
+    """
+    Lists the run files of the source folder with their size, modification time and number of Events entries.
+    The entries are read from the metadata with uproot, only for the files that changed since the previous table.
+
+    Parameters:
+    - source_folder: Folder with the reco_runN_3D.root files.
+    - previous: The files table already in the catalog (None to read every file).
+    - workers: Number of files read at the same time.
+
+    Returns:
+    - A DataFrame with the 'run_number', 'path', 'size', 'mtime_ns' and 'entries' columns.
+    """
+    rows = []
+    for path in glob.glob(os.path.join(source_folder, 'reco_run*_3D.root')):
+        match = RUN_FILE_PATTERN.search(os.path.basename(path))
+        if match:
+            stat = os.stat(path)
+            rows.append({'run_number': int(match.group(1)), 'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+    files = pd.DataFrame(rows, columns=['run_number', 'path', 'size', 'mtime_ns'])
+    known = {}
+    if previous is not None and len(previous):
+        known = {(row.path, row.size, row.mtime_ns): row.entries for row in previous.itertuples()}
+    todo = [path for path, size, mtime_ns in zip(files['path'], files['size'], files['mtime_ns'])
+            if (path, size, mtime_ns) not in known]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        entries = dict(zip(todo, executor.map(tree_entries, todo)))
+    files['entries'] = [entries[path] if path in entries else known[(path, size, mtime_ns)]
+                        for path, size, mtime_ns in zip(files['path'], files['size'], files['mtime_ns'])]
+    return files.sort_values('run_number')
+
+def combine_runs(runlog, logbook, files):
+    """
+    Builds one row per run from the Runlog rows, the logbook row whose run range contains the run
+    and the run file. A run appears if it is in at least one of the three tables.
+
+    Parameters:
+    - runlog: The runlog table (may be empty).
+    - logbook: The logbook table (may be empty).
+    - files: The files table (may be empty).
+
+    Returns:
+    - The runs DataFrame.
+    """
+    run_numbers = set()
+    if len(runlog):
+        run_numbers.update(runlog['run_number'])
+    if len(files):
+        run_numbers.update(files['run_number'])
+    expanded = pd.DataFrame()
+    if len(logbook):
+        # One row per run of each range, the first logbook row wins when ranges overlap
+        expanded = logbook.loc[logbook.index.repeat(logbook['stop_run'] - logbook['start_run'] + 1)].copy()
+        expanded['run_number'] = expanded['start_run'] + expanded.groupby(level=0).cumcount()
+        expanded = expanded.drop_duplicates('run_number').drop(columns=['start_run', 'stop_run'])
+        run_numbers.update(expanded['run_number'])
+    runs = pd.DataFrame({'run_number': sorted(int(run) for run in run_numbers)})
+    for table in [runlog, expanded, files]:
+        if len(table):
+            runs = runs.merge(table, on='run_number', how='left')
+    return runs
+
+def update_catalog(catalog_path, runlog_path=None, logbook_path=None, source_folder=None, workers=1):
+    """
+    Creates or updates the SQLite run catalog. The given sources replace their table ('runlog', 'logbook', 'files'),
+    the others are kept, then the 'runs' table joining them is rebuilt with its indexes.
+
+    Parameters:
+    - catalog_path: Path to the SQLite file.
+    - runlog_path: Runlog CSV to load (None to keep the one in the catalog).
+    - logbook_path: Excel logbook to load (None to keep the one in the catalog).
+    - source_folder: Folder of the run files to scan (None to keep the files in the catalog).
+    - workers: Number of run files read at the same time.
+
+    Returns:
+    - The number of runs in the catalog.
+    """
+    with sqlite3.connect(catalog_path) as connection:
+        if runlog_path is not None:
+            runlog_table(runlog_path).to_sql('runlog', connection, if_exists='replace', index=False)
+        if logbook_path is not None:
+            logbook_table(logbook_path).to_sql('logbook', connection, if_exists='replace', index=False)
+        if source_folder is not None:
+            files = files_table(source_folder, table_frame(connection, 'files'), workers)
+            files.to_sql('files', connection, if_exists='replace', index=False)
+        runs = combine_runs(table_frame(connection, 'runlog'), table_frame(connection, 'logbook'),
+                            table_frame(connection, 'files'))
+        runs.to_sql('runs', connection, if_exists='replace', index=False)
+        connection.execute("CREATE UNIQUE INDEX runs_run_number ON runs (run_number)")
+        for name, columns in RUN_INDEXES.items():
+            if all(column in runs.columns for column in columns):
+                connection.execute(f"CREATE INDEX runs_{name} ON runs ({', '.join(columns)})")
+    return len(runs)
+
+def query_runs(catalog_path, where=None, columns='*'):
+    """
+    Selects runs from the catalog.
+
+    Parameters:
+    - catalog_path: Path to the SQLite file.
+    - where: SQL condition on the columns of the runs table, e.g. "DRIFT_V = 500 AND entries > 0" (None for every run).
+    - columns: SQL list of the columns to return.
+
+    Returns:
+    - A DataFrame with the selected runs, ordered by run number.
+    """
+    if not os.path.exists(catalog_path):
+        raise FileNotFoundError(f"No run catalog {catalog_path}, create it with the catalog subcommand")
+    sql = f"SELECT {columns} FROM runs" + (f" WHERE {where}" if where else "") + " ORDER BY run_number"
+    with sqlite3.connect(f"file:{catalog_path}?mode=ro", uri=True) as connection:
+        return pd.read_sql(sql, connection)
+
+def runs_columns(catalog_path):
+    """
+    Returns the names of the columns of the runs table of the catalog.
+
+    Parameters:
+    - catalog_path: Path to the SQLite file.
+    """
+    with sqlite3.connect(f"file:{catalog_path}?mode=ro", uri=True) as connection:
+        return [row[1] for row in connection.execute('PRAGMA table_info("runs")')]
+
+def query_groups(catalog_path, where=None, group_by=DEFAULT_GROUP_BY):
+    """
+    Selects runs from the catalog and groups them, like group_runs does for the Runlog.
+    If the catalog has the run files, the path of each run is returned too (None for the runs without a file).
+
+    Parameters:
+    - catalog_path: Path to the SQLite file.
+    - where: SQL condition on the columns of the runs table (None for every run).
+    - group_by: Comma separated columns the runs are grouped by.
+
+    Returns:
+    - A DataFrame with the group_by columns, the 'run_number' (list) column and, if the catalog has the run files,
+      the 'path' (list, in the same order) column, one row per group.
+    """
+    keys = [column.strip() for column in group_by.split(',') if column.strip()]
+    columns = ['run_number'] + [f'"{key}"' for key in keys]
+    with_paths = 'path' in runs_columns(catalog_path) and 'path' not in keys
+    if with_paths:
+        columns.append('path')
+    runs = query_runs(catalog_path, where, ', '.join(columns))
+    groups = runs.groupby(keys, dropna=False)
+    grouped = groups['run_number'].apply(list).reset_index()
+    if with_paths:
+        grouped['path'] = groups['path'].apply(list).values
+    return grouped
+
+def run(args):
+    """
+    Runs the catalog subcommand: updates the catalog with the given sources and prints the selected groups.
+
+    Parameters:
+    - args: The parsed command line arguments.
+    """
+    if args.runlog is not None or args.logbook is not None or args.source is not None:
+        n_runs = update_catalog(args.catalog, args.runlog, args.logbook, args.source, args.workers)
+        print(f"{n_runs} runs in {args.catalog}")
+    if args.where is not None or args.verbose:
+        for index, row in query_groups(args.catalog, args.where, args.group_by).iterrows():
+            key = ', '.join(f"{column}={row[column]}" for column in row.index if column not in ('run_number', 'path'))
+            print(f"{key}: {len(row['run_number'])} runs {row['run_number']}")
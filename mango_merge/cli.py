@@ -0,0 +1,221 @@
+import os
+import argparse
+import sys
+from .merging import MERGE_BACKENDS, compression_setting
+
+def gigabytes(value):
+    """
+    Converts a command line size in GB to bytes.
+    """
+    return int(float(value) * 1e9)
+
+def add_split_arguments(parser):
+    """
+    Adds to a subcommand the options splitting the oversized groups of runs into several merged files.
+
+    Parameters:
+    - parser: The subcommand parser.
+    """
+    parser.add_argument('--max-size',help='split the groups whose input files exceed this many GB into reco_runX-Y_3D_partK.root files', action='store', type=gigabytes,default=None, dest='max_bytes')
+    parser.add_argument('--max-entries',help='split the groups with more Events entries than this into reco_runX-Y_3D_partK.root files', action='store', type=int,default=None)
+
+def add_merge_arguments(parser):
+    """
+    Adds to a subcommand the options controlling how the merge jobs are run.
+
+    Parameters:
+    - parser: The subcommand parser.
+    """
+    parser.add_argument('-w','--workers',help='number of merge jobs running in parallel', action='store', type=int,default=1)
+    parser.add_argument('-j','--hadd-jobs',help='number of processes used by each hadd (hadd -j)', action='store', type=int,default=None)
+    parser.add_argument('-b','--backend',help='merge with the hadd executable or in-process with ROOT', action='store', type=str,default='hadd', choices=MERGE_BACKENDS)
+    parser.add_argument('--chunk-size',help='maximum number of input files opened at once by the root backend, its progress moves one chunk at a time', action='store', type=int,default=50)
+    parser.add_argument('--compression',help='compression of the merged files: zstd, lz4, lzma or zlib with an optional :level, a ROOT setting like 505, or keep to copy the compressed data of the inputs without recompressing it', action='store', type=compression_setting,default=None)
+    parser.add_argument('--rebuild',help='ignore the merge manifest and rebuild every merged file', action='store_true')
+    parser.add_argument('--resume',help='continue an interrupted merge, checking the events of the merged files already completed', action='store_true')
+    parser.add_argument('--report',help='write the time, CPU, memory and I/O of each stage and merge job to this JSON file', action='store', type=str,default=None)
+    parser.add_argument('--trace',help='write the stages and merge jobs as a Chrome trace to this JSON file', action='store', type=str,default=None)
+
+def add_selection_arguments(parser):
+    """
+    Adds to a subcommand the options choosing where the groups of runs come from (Runlog, excel logbook or run catalog).
+
+    Parameters:
+    - parser: The subcommand parser.
+    """
+    origin = parser.add_mutually_exclusive_group(required=True)
+    origin.add_argument('-run','--runlog',help='Runlog CSV, runs grouped by source position and drift field', action='store', type=str)
+    origin.add_argument('-log','--logbook',help='excel logbook, runs selected from the ED rows', action='store', type=str)
+    origin.add_argument('-cat','--catalog',help='SQLite run catalog, runs selected with --where and grouped with --group-by', action='store', type=str)
+    parser.add_argument('--where',help='SQL condition on the catalog runs, e.g. "DRIFT_V = 500 AND entries > 0"', action='store', type=str,default=None)
+    parser.add_argument('--group-by',help='comma separated catalog columns the runs are grouped by', action='store', type=str,default='source_position,DRIFT_V')
+    parser.add_argument('-s','--source',help='source folder where the bare run are stored (default source or NID_source)', action='store', type=str,default=None)
+    parser.add_argument('-t','--target',help='target folder where the merged run are stored (default target or NID_target)', action='store', type=str,default=None)
+    parser.add_argument('-v','--verbose',help='print more info', action='store_true')
+
+def build_parser():
+    """
+    Builds the command line parser with the logbook, runlog, merge, plan, catalog, ingest and benchmark subcommands.
+    """
+    parser = argparse.ArgumentParser(prog='mango_merge', description='Hadd and in case add env variables to MANGO runs', epilog='Version: 1.0')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    logbook = subparsers.add_parser('logbook', help='merge runs selected from the excel logbook and append the logbook env variables')
+    logbook.add_argument('-c','--compress',help='compress multiple run in single run file', action='store', type=int,default=None)
+    logbook.add_argument('-t','--target',help='target folder where the compressed run are stored', action='store', type=str,default="NID_target")
+    logbook.add_argument('-s','--source',help='source folder where the bare run are stored', action='store', type=str,default="NID_source")
+    logbook.add_argument('-env','--environment',help='append new branch to compress run with run variables', action='store', type=int,default=None)
+    logbook.add_argument('-log','--logbook',help='Logbook to read', action='store', type=str,default='MANGO_LNGS_Logbook_temp.xlsx')
+    logbook.add_argument('-v','--verbose',help='write something to print more info', action='store', type=int,default=None)
+    add_merge_arguments(logbook)
+    add_split_arguments(logbook)
+    logbook.set_defaults(func=run_logbook)
+
+    runlog = subparsers.add_parser('runlog', help='merge the Runlog runs with the same description and attach the MIDAS env variables')
+    runlog.add_argument('-log','--logbook',help='Logbook to read', action='store', type=str,default='MANGO_Data_Runs.csv')
+    runlog.add_argument('-s','--source',help='source folder where the bare run are stored', action='store', type=str,default="source")
+    runlog.add_argument('-t','--target',help='target folder where the merged run are stored', action='store', type=str,default="target")
+    runlog.add_argument('--history',help='mhist output with the MIDAS history', action='store', type=str,default='history_output.csv')
+    runlog.add_argument('-v','--verbose',help='print more info', action='store_true')
+    runlog.add_argument('-env','--env',help='attach environmental variables from log', action='store_true')
+    add_merge_arguments(runlog)
+    add_split_arguments(runlog)
+    runlog.add_argument('-out','--attach-to-output',help='leave the source files untouched and write one table of env variables per merged file', action='store_true')
+    runlog.add_argument('--store',help='folder of the local MIDAS history store to read the env variables from', action='store', type=str,default=None)
+    runlog.add_argument('--fetch',help='download from the DAQ machine the history missing in the store', action='store_true')
+    runlog.add_argument('-win','--window',help='also store mean, min, max, std and number of samples of each sensor during the run', action='store_true')
+    runlog.add_argument('--stop-column',help='column of the Runlog with the run stop time, used by --window', action='store', type=str,default='stop_time')
+    runlog.add_argument('-evt','--per-event',help='also write the EventEnv tree with the env variables interpolated at the time of each event', action='store_true')
+    runlog.add_argument('--time-branch',help='branch of Events with the event time in seconds since the epoch, used by --per-event', action='store', type=str,default='timestamp')
+    runlog.add_argument('-tz','--history-timezone',help='time zone of the MIDAS history times, used by --per-event to compare them with the event timestamps', action='store', type=str,default='Europe/Rome')
+    runlog.add_argument('-tol','--tolerance',help='maximum distance in seconds between run start and env sample', action='store', type=float,default=None)
+    runlog.add_argument('-dir','--direction',help='how to match env samples to the run start', action='store', type=str,default='nearest', choices=['nearest', 'backward', 'forward'])
+    runlog.set_defaults(func=run_runlog)
+
+    merge = subparsers.add_parser('merge', help='only merge the groups of runs, without env variables')
+    add_selection_arguments(merge)
+    add_split_arguments(merge)
+    add_merge_arguments(merge)
+    merge.set_defaults(func=run_merge)
+
+    plan = subparsers.add_parser('plan', help='print the merged files, their inputs and expected sizes without merging')
+    add_selection_arguments(plan)
+    add_split_arguments(plan)
+    plan.set_defaults(func=run_plan)
+
+    catalog = subparsers.add_parser('catalog', help='build or update the SQLite run catalog from the Runlog, the logbook and the run files, and query it')
+    catalog.add_argument('-db','--catalog',help='SQLite file of the catalog', action='store', type=str,default='run_catalog.sqlite')
+    catalog.add_argument('-run','--runlog',help='Runlog CSV to load into the catalog', action='store', type=str,default=None)
+    catalog.add_argument('-log','--logbook',help='excel logbook to load into the catalog', action='store', type=str,default=None)
+    catalog.add_argument('-s','--source',help='folder of the run files to scan for size and number of events', action='store', type=str,default=None)
+    catalog.add_argument('-w','--workers',help='number of run files read in parallel', action='store', type=int,default=1)
+    catalog.add_argument('--where',help='print the groups of the runs matching this SQL condition', action='store', type=str,default=None)
+    catalog.add_argument('--group-by',help='comma separated columns the runs are grouped by', action='store', type=str,default='source_position,DRIFT_V')
+    catalog.add_argument('-v','--verbose',help='print the groups of all the runs', action='store_true')
+    catalog.set_defaults(func=run_catalog)
+
+    ingest = subparsers.add_parser('ingest', help='extract from the tar archives only the runs of the Runlog or logbook into the source folder')
+    ingest.add_argument('archives',help='tar archives of reconstructed runs (.tar, .tar.gz, .tar.xz, .tar.zst)', nargs='+')
+    add_selection_arguments(ingest)
+    ingest.add_argument('-w','--workers',help='number of archives read in parallel', action='store', type=int,default=1)
+    ingest.add_argument('-o','--output',help='JSON report with the extracted, present and missing runs', action='store', type=str,default=None)
+    ingest.set_defaults(func=run_ingest)
+
+    benchmark = subparsers.add_parser('benchmark', help='time each stage of the pipeline on synthetic data')
+    benchmark.add_argument('-n','--runs',help='number of synthetic runs', action='store', type=int,default=50)
+    benchmark.add_argument('-e','--events',help='number of events per run', action='store', type=int,default=1000)
+    benchmark.add_argument('--hours',help='length of the synthetic MIDAS history in hours', action='store', type=float,default=24)
+    benchmark.add_argument('--workdir',help='folder where the synthetic data are kept (default a temporary folder)', action='store', type=str,default=None)
+    benchmark.add_argument('-w','--workers',help='number of merge jobs and annotation processes running in parallel', action='store', type=int,default=1)
+    benchmark.add_argument('-b','--backend',help='merge with the hadd executable or in-process with ROOT', action='store', type=str,default='hadd', choices=MERGE_BACKENDS)
+    benchmark.add_argument('--compression',help='compression of the merged files, as for the merge subcommands', action='store', type=compression_setting,default=None)
+    benchmark.add_argument('-o','--output',help='JSON report', action='store', type=str,default='benchmark.json')
+    benchmark.set_defaults(func=run_benchmark)
+    return parser
+
+def grouped_jobs(args):
+    """
+    Builds one merge job for each group of runs of the Runlog, of the excel logbook or of the run catalog.
+
+    Parameters:
+    - args: The parsed command line arguments.
+
+    Returns:
+    - A list of (target_path, input_paths) tuples.
+    """
+    if args.runlog is not None or args.catalog is not None:
+        from . import runlog
+        source, target = args.source or "source", args.target or "target"
+        if args.catalog is not None:
+            from .catalog import query_groups
+            groups = query_groups(args.catalog, args.where, args.group_by)
+            # The runs scanned into the catalog are taken from where they were found, the others from the source folder
+            folders = {os.path.normpath(os.path.dirname(path)) for paths in groups.get('path', []) for path in paths if isinstance(path, str)}
+            if args.source is not None and folders - {os.path.normpath(args.source)}:
+                print(f"Warning: the catalog files are in {', '.join(sorted(folders))}, "
+                      f"{args.source} is only used for the runs without a file in the catalog")
+            return runlog.generate_hadd_jobs(groups, source, target)
+        return runlog.generate_hadd_jobs(runlog.group_runs(runlog.read_runlog(args.runlog)), source, target)
+    from . import logbook
+    source, target = args.source or "NID_source", args.target or "NID_target"
+    return logbook.generate_hadd_jobs(logbook.select_runs(logbook.load_logbook(args.logbook)), source, target)
+
+def selected_jobs(args):
+    """
+    Builds the merge jobs of the merge and plan subcommands with grouped_jobs, the oversized groups split into parts.
+
+    Parameters:
+    - args: The parsed command line arguments.
+
+    Returns:
+    - A list of (target_path, input_paths) tuples.
+    """
+    from .merging import split_jobs
+    return split_jobs(grouped_jobs(args), args.max_bytes, args.max_entries)
+
+def run_logbook(args):
+    from . import logbook
+    logbook.run(args)
+
+def run_runlog(args):
+    from . import runlog
+    runlog.run(args)
+
+def run_merge(args):
+    from .merging import merge_incrementally
+    from .instrumentation import Instrumentation, write_instrumentation
+    instrumentation = Instrumentation()
+    with instrumentation.stage('planning') as info:
+        jobs = selected_jobs(args)
+        info['output_files'] = len(jobs)
+    target = args.target or ("NID_target" if args.logbook is not None else "target")
+    merge_incrementally(jobs, target, rebuild=args.rebuild, resume=args.resume, verbose=args.verbose, instrumentation=instrumentation,
+                        workers=args.workers, hadd_jobs=args.hadd_jobs, backend=args.backend, chunk_size=args.chunk_size,
+                        compression=args.compression)
+    write_instrumentation(instrumentation, args.report, args.trace)
+
+def run_plan(args):
+    from .merging import print_plan
+    print_plan(selected_jobs(args), verbose=args.verbose)
+
+def run_catalog(args):
+    from . import catalog
+    catalog.run(args)
+
+def run_ingest(args):
+    from . import ingest
+    ingest.run(args)
+
+def run_benchmark(args):
+    from . import benchmark
+    benchmark.run(args)
+
+def main(argv=None):
+    """
+    Entry point of `python -m mango_merge`.
+
+    Parameters:
+    - argv: The command line arguments (default sys.argv[1:]).
+    """
+    args = build_parser().parse_args(sys.argv[1:] if argv is None else argv)
+    args.func(args)
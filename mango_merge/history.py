@@ -0,0 +1,251 @@
+import os
+import json
+import io
+from itertools import islice
+import pandas as pd
+import numpy as np
+from .merging import file_hash
+
+MANGO_SENSOR_COLUMNS = ['KEG_temp', 'KEG_pressure', 'KEG_humidity', 'MANGOlino_temp', 'MANGOlino_pressure', 'MANGOlino_humidity']
+
+def parse_mhist_lines(lines, columns):
+    """
+    Parses a block of mhist data lines with the C parser of pandas.
+    mhist separates the fields with one or more tabs, they are squeezed to a single tab first.
+
+    Parameters:
+    - lines: List of data lines (header already removed).
+    - columns: Names of the sensor columns following the time.
+
+    Returns:
+    - A DataFrame with a 'Time' string column and one float32 column for each sensor.
+    """
+    text = ''.join(lines)
+    while '\t\t' in text:
+        text = text.replace('\t\t', '\t')
+    names = ['Time'] + list(columns)
+    block = pd.read_csv(io.StringIO(text), sep='\t', header=None, names=names, usecols=range(len(names)),
+                        dtype={name: np.float32 for name in columns} | {'Time': str}, engine='c')
+    return block
+
+def read_mhist(path, columns=MANGO_SENSOR_COLUMNS, skiprows=8, chunk_lines=1_000_000, cache_dir=None):
+    """
+    Reads the output of mhist (history_output.csv) into a typed DataFrame.
+    The file is streamed in blocks of chunk_lines lines, the sensor columns are stored as float32
+    and the rows are indexed by the parsed 'Time', sorted.
+    The result is cached as Parquet, keyed by the hash of the file, so reading the same dump again is immediate.
+    The cache is skipped when pyarrow is not installed.
+
+    Parameters:
+    - path: Path of the mhist output.
+    - columns: Names of the sensor columns following the time.
+    - skiprows: Number of header lines written by mhist before the data.
+    - chunk_lines: Number of lines parsed at a time.
+    - cache_dir: Folder of the Parquet cache (default '.mhist_cache' next to the file), False disables the cache.
+
+    Returns:
+    - A DataFrame with a DatetimeIndex named 'Time' and one float32 column for each sensor.
+    """
+    cache_path = None
+    if cache_dir is not False:
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), '.mhist_cache')
+        cache_path = os.path.join(cache_dir, f"{os.path.basename(path)}.{file_hash(path)}.parquet")
+        if os.path.exists(cache_path):
+            try:
+                return pd.read_parquet(cache_path)
+            except ImportError:
+                cache_path = None
+
+    blocks = []
+    with open(path) as f:
+        for _ in range(skiprows):
+            next(f, None)
+        while True:
+            lines = list(islice(f, chunk_lines))
+            if not lines:
+                break
+            block = parse_mhist_lines(lines, columns)
+            if len(block):
+                blocks.append(block)
+    if blocks:
+        history = pd.concat(blocks, ignore_index=True)
+    else:
+        history = pd.DataFrame({name: pd.Series(dtype=np.float32) for name in columns} | {'Time': pd.Series(dtype=str)})
+
+    history['Time'] = pd.to_datetime(history['Time'].str.strip(), errors='coerce')
+    history = history.dropna(subset=['Time']).set_index('Time').sort_index(kind='mergesort')
+
+    if cache_path is not None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            history.to_parquet(cache_path)
+        except ImportError:
+            print("pyarrow not installed, the parsed history is not cached")
+    return history
+
+def mhist_time(timestamp):
+    """
+    Formats a timestamp the way mhist expects it for its -s and -p options (YYMMDD.HHMMSS).
+
+    Parameters:
+    - timestamp: Anything accepted by pd.Timestamp.
+    """
+    return pd.Timestamp(timestamp).strftime('%y%m%d.%H%M%S')
+
+def fetch_mhist_ssh(start, stop, user="cygno01", host="172.17.19.155", mhist="/home/software//midas/bin/mhist",
+                    event="MANGOSensors", output_folder="."):
+    """
+    Dumps the MIDAS history between start and stop on the DAQ machine and copies it here (same as scp_DAQhistory.sh).
+    It is the default fetcher of HistoryStore.update, any function with the same (start, stop) -> path
+    signature can replace it, for example one copying dumps from a local folder.
+
+    Parameters:
+    - start: Start of the time range.
+    - stop: End of the time range.
+    - user: User on the DAQ machine.
+    - host: Address of the DAQ machine (needs the LNGS VPN).
+    - mhist: Path of the mhist executable on the DAQ machine.
+    - event: MIDAS history event to dump.
+    - output_folder: Local folder where the dump is copied.
+
+    Returns:
+    - The path of the local copy of the dump.
+    """
+    from subprocess import run
+    file_name = f"history_{mhist_time(start)}-{mhist_time(stop)}.csv"
+    remote_command = f"{mhist} -e {event} -s {mhist_time(start)} -p {mhist_time(stop)} > ~/{file_name}"
+    run(['ssh', f"{user}@{host}", remote_command], check=True)
+    local_path = os.path.join(output_folder, file_name)
+    run(['scp', f"{user}@{host}:~/{file_name}", local_path], check=True)
+    return local_path
+
+class HistoryStore:
+    """
+    Local store of the environmental history, split in one Parquet file per day (YYYY-MM-DD.parquet).
+    New dumps are merged into the existing days dropping the duplicated samples, and the time ranges
+    already downloaded are kept in coverage.json so that only the missing ones have to be fetched.
+    """
+
+    def __init__(self, folder, columns=MANGO_SENSOR_COLUMNS):
+        """
+        Parameters:
+        - folder: Folder of the store, created if needed.
+        - columns: Names of the sensor columns.
+        """
+        self.folder = folder
+        self.columns = list(columns)
+        os.makedirs(folder, exist_ok=True)
+
+    def partition_path(self, day):
+        """
+        Returns the path of the Parquet file holding the samples of the given day.
+        """
+        return os.path.join(self.folder, f"{pd.Timestamp(day).strftime('%Y-%m-%d')}.parquet")
+
+    def coverage(self):
+        """
+        Returns the sorted list of (start, stop) timestamps already stored.
+        """
+        coverage_path = os.path.join(self.folder, 'coverage.json')
+        if not os.path.exists(coverage_path):
+            return []
+        with open(coverage_path) as f:
+            return [(pd.Timestamp(start), pd.Timestamp(stop)) for start, stop in json.load(f)]
+
+    def add_coverage(self, start, stop):
+        """
+        Adds the range [start, stop] to the stored coverage, merging the overlapping ranges.
+        """
+        ranges = sorted(self.coverage() + [(pd.Timestamp(start), pd.Timestamp(stop))])
+        merged = [ranges[0]]
+        for range_start, range_stop in ranges[1:]:
+            if range_start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], range_stop))
+            else:
+                merged.append((range_start, range_stop))
+        coverage_path = os.path.join(self.folder, 'coverage.json')
+        with open(coverage_path + '.tmp', 'w') as f:
+            json.dump([[str(range_start), str(range_stop)] for range_start, range_stop in merged], f, indent=1)
+        os.replace(coverage_path + '.tmp', coverage_path)
+
+    def add(self, history, start=None, stop=None):
+        """
+        Merges a history (as returned by read_mhist) into the daily partitions, keeping the newest copy
+        of the samples with the same time.
+
+        Parameters:
+        - history: DataFrame with a DatetimeIndex and the sensor columns.
+        - start: Start of the range covered by the dump (default the first sample).
+        - stop: End of the range covered by the dump (default the last sample).
+        """
+        if len(history) == 0 and (start is None or stop is None):
+            return
+        history = history[self.columns]
+        for day, day_history in history.groupby(history.index.normalize()):
+            path = self.partition_path(day)
+            if os.path.exists(path):
+                day_history = pd.concat([pd.read_parquet(path), day_history])
+            day_history = day_history[~day_history.index.duplicated(keep='last')].sort_index(kind='mergesort')
+            day_history.to_parquet(path + '.tmp')
+            os.replace(path + '.tmp', path)
+        self.add_coverage(history.index.min() if start is None else start,
+                          history.index.max() if stop is None else stop)
+
+    def query(self, start, stop):
+        """
+        Returns the samples between start and stop, reading only the partitions of the days in the range.
+
+        Parameters:
+        - start: Start of the time range.
+        - stop: End of the time range.
+
+        Returns:
+        - A DataFrame with a DatetimeIndex named 'Time' and the sensor columns, sorted by time.
+        """
+        start, stop = pd.Timestamp(start), pd.Timestamp(stop)
+        days = pd.date_range(start.normalize(), stop.normalize(), freq='D')
+        parts = [pd.read_parquet(self.partition_path(day)) for day in days if os.path.exists(self.partition_path(day))]
+        if not parts:
+            empty = pd.DataFrame({name: pd.Series(dtype=np.float32) for name in self.columns})
+            empty.index = pd.DatetimeIndex([], name='Time')
+            return empty
+        history = pd.concat(parts)
+        return history.loc[start:stop]
+
+    def missing_ranges(self, start, stop):
+        """
+        Returns the list of (start, stop) ranges inside [start, stop] that are not in the store yet.
+        """
+        start, stop = pd.Timestamp(start), pd.Timestamp(stop)
+        missing = []
+        cursor = start
+        for range_start, range_stop in self.coverage():
+            if range_stop < cursor:
+                continue
+            if range_start > stop:
+                break
+            if range_start > cursor:
+                missing.append((cursor, range_start))
+            cursor = max(cursor, range_stop)
+        if cursor < stop:
+            missing.append((cursor, stop))
+        return missing
+
+    def update(self, start, stop, fetcher=fetch_mhist_ssh):
+        """
+        Fetches and stores the missing ranges between start and stop.
+
+        Parameters:
+        - start: Start of the time range.
+        - stop: End of the time range.
+        - fetcher: Function (start, stop) -> path of an mhist dump of that range.
+
+        Returns:
+        - The list of ranges that have been fetched.
+        """
+        missing = self.missing_ranges(start, stop)
+        for range_start, range_stop in missing:
+            print(f"Fetching history from {range_start} to {range_stop}")
+            self.add(read_mhist(fetcher(range_start, range_stop), self.columns, cache_dir=False), range_start, range_stop)
+        return missing
@@ -0,0 +1,168 @@
+import os
+import json
+import tarfile
+import shutil
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+ZSTD_EXTENSIONS = ('.zst', '.zstd', '.tzst')
+
+@contextmanager
+def open_archive(archive_path):
+    """
+    Opens a tar archive (plain, gzip, bzip2, xz or zstd) for reading as a stream, one member after the other,
+    so it is read only once from the start and never seeked.
+
+    Parameters:
+    - archive_path: Path to the archive.
+
+    Returns:
+    - A context manager yielding the tarfile.TarFile.
+    """
+    with open(archive_path, 'rb') as f:
+        if archive_path.endswith(ZSTD_EXTENSIONS):
+            try:
+                import zstandard
+            except ImportError:
+                raise ImportError(f"Reading {archive_path} needs the zstandard package")
+            stream, mode = zstandard.ZstdDecompressor().stream_reader(f), 'r|'
+        else:
+            stream, mode = f, 'r|*'
+        with tarfile.open(fileobj=stream, mode=mode) as tar:
+            yield tar
+
+def extract_archive(archive_path, wanted, claim, release, finished):
+    """
+    Streams through an archive and extracts the members whose file name is in wanted.
+    A member is written to a temporary file renamed when complete, and skipped if the file is already there
+    with the same size. The reading stops as soon as every wanted file has been found in some archive.
+    If the archive cannot be read to the end (corrupt or truncated), the temporary file is removed
+    and the files claimed but not extracted are released, so another archive can provide them.
+
+    Parameters:
+    - archive_path: Path to the archive.
+    - wanted: Dictionary mapping the file names to extract (like 'reco_run123_3D.root') to their destination path.
+    - claim: Function called with a file name found in the archive, returns False if another archive already has it.
+    - release: Function called with a claimed file name that could not be extracted.
+    - finished: Function returning True once every wanted file has been found.
+
+    Returns:
+    - A list of (file_name, status) tuples, status being 'extracted' or 'present', and the error message
+      (None if the whole archive could be read).
+    """
+    results = []
+    name = partial = None
+    try:
+        with open_archive(archive_path) as tar:
+            for member in tar:
+                if finished():
+                    break
+                name = os.path.basename(member.name)
+                if not member.isfile() or name not in wanted or not claim(name):
+                    name = None
+                    continue
+                destination = wanted[name]
+                if os.path.exists(destination) and os.path.getsize(destination) == member.size:
+                    results.append((name, 'present'))
+                    name = None
+                    continue
+                os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+                partial = destination + '.partial'
+                with tar.extractfile(member) as source, open(partial, 'wb') as target:
+                    shutil.copyfileobj(source, target, 1 << 20)
+                os.replace(partial, destination)
+                results.append((name, 'extracted'))
+                name = partial = None
+    except Exception as e:
+        if partial is not None and os.path.exists(partial):
+            os.remove(partial)
+        if name is not None:
+            release(name)
+        return results, f"{type(e).__name__}: {e}"
+    return results, None
+
+def extract_runs(input_paths, archives, workers=1):
+    """
+    Extracts from the archives only the input files of the merge jobs, reading the archives in parallel.
+    Each file is taken from the first archive it is found in. An archive that cannot be read does not stop the others:
+    the files it could not provide are looked for again in the other archives.
+
+    Parameters:
+    - input_paths: Paths of the run files needed by the merge, like 'source/reco_run123_3D.root'.
+    - archives: List of archive paths.
+    - workers: Number of archives read at the same time.
+
+    Returns:
+    - A dictionary with the sorted lists of 'extracted', 'present' (already there with the right size),
+      'on_disk' (in no archive but already there) and 'missing' (neither in an archive nor on disk) paths, and 'failed', the list of {'archive', 'error'} of the unreadable archives.
+    """
+    wanted = {os.path.basename(path): path for path in input_paths}
+    found = set()
+    released = set()
+    lock = threading.Lock()
+
+    def claim(name):
+        with lock:
+            if name in found:
+                return False
+            found.add(name)
+            return True
+
+    def release(name):
+        with lock:
+            found.discard(name)
+            released.add(name)
+
+    report = {'extracted': [], 'present': [], 'on_disk': [], 'missing': [], 'failed': []}
+
+    def scan(archive_list, names):
+        # Returns the archives that could not be read to the end
+        failed = []
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {executor.submit(extract_archive, archive, names, claim, release, lambda: names.keys() <= found):
+                       archive for archive in archive_list}
+            for future in as_completed(futures):
+                results, error = future.result()
+                print(f"{futures[future]}: {len(results)} files" + (f", {error}" if error else ""))
+                for name, status in results:
+                    report[status].append(wanted[name])
+                if error is not None:
+                    failed.append(futures[future])
+                    report['failed'].append({'archive': futures[future], 'error': error})
+        return failed
+
+    failed = scan(archives, wanted)
+    left = {name: wanted[name] for name in released if name not in found}
+    readable = [archive for archive in archives if archive not in failed]
+    if failed and left and readable:
+        # The readable archives may have passed the files an unreadable archive had claimed
+        scan(readable, left)
+    # The files in no archive are only missing for the merge if they are not in the source folder either
+    not_archived = [path for name, path in wanted.items() if name not in found]
+    report['on_disk'] = [path for path in not_archived if os.path.exists(path)]
+    report['missing'] = [path for path in not_archived if not os.path.exists(path)]
+    return {key: sorted(values) if key != 'failed' else values for key, values in report.items()}
+
+def run(args):
+    """
+    Runs the ingest subcommand: extracts from the archives the runs of the Runlog or logbook selection
+    into the source folder and reports the runs that are neither in an archive nor already in the source folder.
+
+    Parameters:
+    - args: The parsed command line arguments.
+    """
+    from .cli import grouped_jobs
+    input_paths = sorted({path for target_path, paths in grouped_jobs(args) for path in paths})
+    print(f"Looking for {len(input_paths)} runs in {len(args.archives)} archives")
+    report = extract_runs(input_paths, args.archives, args.workers)
+    print(f"{len(report['extracted'])} extracted, {len(report['present'])} already present, "
+          f"{len(report['on_disk'])} only on disk, {len(report['missing'])} missing")
+    for failure in report['failed']:
+        print(f"Could not read {failure['archive']}: {failure['error']}")
+    for path in report['missing']:
+        print(f"Missing: {path}")
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+        print(f"Report written to {args.output}")
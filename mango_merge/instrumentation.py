@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import resource
+import threading
+from contextlib import contextmanager
+
+def io_counters():
+    """
+    Returns the number of bytes read from and written to the storage so far by this process
+    (read_bytes and write_bytes of /proc/self/io) and by its finished children (block counts of getrusage,
+    512 bytes per block), the same block I/O reported for the merge jobs: reads served by the page cache
+    and pipes are not counted. The counters of this process are zero where /proc is not available.
+    """
+    read_bytes = written_bytes = 0
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(':') for line in f.read().splitlines())
+        read_bytes, written_bytes = int(counters['read_bytes']), int(counters['write_bytes'])
+    except (OSError, KeyError, ValueError):
+        pass
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return read_bytes + children.ru_inblock * 512, written_bytes + children.ru_oublock * 512
+
+def cpu_seconds():
+    """
+    Returns the CPU time (user + system) used so far by this process and its finished children.
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+def peak_rss_mb():
+    """
+    Returns the peak resident memory in MB of this process and of the largest of its finished children,
+    since the start of the process (the high-water mark is never reset, so it is a value of the whole run).
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024  # ru_maxrss is in kB on Linux
+
+def rusage_info(usage, before=None):
+    """
+    Converts a resource usage (from os.wait4 or resource.getrusage) to the measurements of a job.
+
+    Parameters:
+    - usage: The resource usage at the end of the job.
+    - before: Optional resource usage at the start of the job, subtracted from usage (the peak memory is kept as is).
+
+    Returns:
+    - A dictionary with 'cpu_s', 'peak_rss_mb', 'bytes_read' and 'bytes_written' (block I/O, 512 bytes per block).
+    """
+    info = {'cpu_s': usage.ru_utime + usage.ru_stime, 'peak_rss_mb': usage.ru_maxrss / 1024,
+            'bytes_read': usage.ru_inblock * 512, 'bytes_written': usage.ru_oublock * 512}
+    if before is not None:
+        info['cpu_s'] -= before.ru_utime + before.ru_stime
+        info['bytes_read'] -= before.ru_inblock * 512
+        info['bytes_written'] -= before.ru_oublock * 512
+    return info
+
+class Instrumentation:
+    """
+    Collects wall time, CPU time, bytes read and written, file counts and event rates of the pipeline stages
+    and of the single merge jobs, the peak memory of each merge job and of the whole run. It only reads counters of the kernel,
+    so it is cheap enough to be always on. The result is written as a JSON report
+    and optionally as a Chrome trace (open it in chrome://tracing or https://ui.perfetto.dev).
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.stages = []
+        self.spans = []
+        self.jobs = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, **info):
+        """
+        Measures the code run inside the with block as the stage name.
+        The yielded dictionary can be filled with 'input_files', 'output_files' and 'events'.
+
+        Parameters:
+        - name: Name of the stage.
+        - info: Initial values of the stage information.
+        """
+        start, cpu_start = time.perf_counter(), cpu_seconds()
+        read_start, written_start = io_counters()
+        try:
+            yield info
+        finally:
+            wall = time.perf_counter() - start
+            read_end, written_end = io_counters()
+            entry = {'name': name, 'start': start - self.origin, 'wall_s': wall,
+                     'cpu_s': cpu_seconds() - cpu_start,
+                     'bytes_read': read_end - read_start, 'bytes_written': written_end - written_start}
+            entry.update(info)
+            if info.get('events') and wall > 0:
+                entry['events_per_s'] = info['events'] / wall
+            with self.lock:
+                self.stages.append(entry)
+
+    @contextmanager
+    def accumulate(self, name, **info):
+        """
+        Measures the code run inside the with block and adds it to the stage name, for a work done one piece
+        at a time inside another stage (like the annotation of each merged file while the merge goes on).
+        Only the wall and CPU time of the calling thread are counted, not those of the threads running meanwhile,
+        and the numeric values of info are summed over the calls.
+
+        Parameters:
+        - name: Name of the stage.
+        - info: Values added to the stage information, like 'output_files'.
+        """
+        start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - start, time.thread_time() - cpu_start
+            with self.lock:
+                entry = next((entry for entry in self.stages if entry['name'] == name and 'calls' in entry), None)
+                if entry is None:
+                    entry = {'name': name, 'start': start - self.origin, 'wall_s': 0.0, 'cpu_s': 0.0, 'calls': 0}
+                    self.stages.append(entry)
+                entry['wall_s'] += wall
+                entry['cpu_s'] += cpu
+                entry['calls'] += 1
+                for key, value in info.items():
+                    entry[key] = entry.get(key, 0) + value
+                self.spans.append({'name': name, 'start': start - self.origin, 'wall_s': wall})
+
+    def record_job(self, name, start, stop, thread=None, **info):
+        """
+        Stores the measurement of one merge job, it can be called from several threads.
+
+        Parameters:
+        - name: Name of the job (its output file).
+        - start: time.perf_counter() when the job started.
+        - stop: time.perf_counter() when the job ended.
+        - thread: Identifier of the worker that ran the job (default the current thread).
+        - info: Other values, like 'input_files', 'input_bytes', 'output_bytes', 'events', 'cpu_s' and 'peak_rss_mb'.
+        """
+        entry = {'name': name, 'start': start - self.origin, 'wall_s': stop - start,
+                 'thread': threading.get_ident() if thread is None else thread}
+        entry.update(info)
+        if info.get('events') and stop > start:
+            entry['events_per_s'] = info['events'] / (stop - start)
+        with self.lock:
+            self.jobs.append(entry)
+
+    def summary(self):
+        """
+        Prints one line per stage with its wall and CPU time, then the peak memory of the run.
+        """
+        for entry in self.stages:
+            calls = f" in {entry['calls']} calls" if 'calls' in entry else ""
+            print(f"{entry['name']:>20}: {entry['wall_s']:8.2f} s wall, {entry['cpu_s']:8.2f} s CPU{calls}")
+        print(f"{'peak memory':>20}: {peak_rss_mb():8.1f} MB")
+
+    def write_report(self, path):
+        """
+        Writes the stages, the jobs and the peak memory of the run as a JSON report.
+
+        Parameters:
+        - path: Path of the JSON file.
+        """
+        with open(path, 'w') as f:
+            json.dump({'stages': self.stages, 'jobs': self.jobs, 'total_wall_s': time.perf_counter() - self.origin,
+                       'peak_rss_mb': peak_rss_mb()}, f, indent=1)
+
+    def write_trace(self, path):
+        """
+        Writes the stages and the jobs in the Chrome trace event format, stages on the first row
+        (the stages measured with accumulate one event for each call) and the jobs on one row for each worker thread.
+
+        Parameters:
+        - path: Path of the JSON file.
+        """
+        events = []
+        for entry in [entry for entry in self.stages if 'calls' not in entry] + self.spans:
+            events.append({'name': entry['name'], 'cat': 'stage', 'ph': 'X', 'pid': 1, 'tid': 0,
+                           'ts': entry['start'] * 1e6, 'dur': entry['wall_s'] * 1e6,
+                           'args': {key: value for key, value in entry.items() if key not in ('name', 'start')}})
+        threads = {}
+        for entry in self.jobs:
+            tid = threads.setdefault(entry['thread'], len(threads) + 1)
+            events.append({'name': os.path.basename(entry['name']), 'cat': 'job', 'ph': 'X', 'pid': 1, 'tid': tid,
+                           'ts': entry['start'] * 1e6, 'dur': entry['wall_s'] * 1e6,
+                           'args': {key: value for key, value in entry.items() if key not in ('start', 'thread')}})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+def write_instrumentation(instrumentation, report_path=None, trace_path=None):
+    """
+    Prints the summary of the stages and writes the JSON report and the Chrome trace if their paths are given.
+
+    Parameters:
+    - instrumentation: The Instrumentation of the run.
+    - report_path: Path of the JSON report (None to skip it).
+    - trace_path: Path of the Chrome trace (None to skip it).
+    """
+    instrumentation.summary()
+    if report_path is not None:
+        instrumentation.write_report(report_path)
+        print(f"Report written to {report_path}")
+    if trace_path is not None:
+        instrumentation.write_trace(trace_path)
+        print(f"Trace written to {trace_path}")
@@ -0,0 +1,216 @@
+import pandas as pd
+from tqdm import tqdm
+import os
+import json
+from .merging import merge_incrementally, annotate_root_file, file_hash, split_job
+from .instrumentation import Instrumentation, write_instrumentation
+
+def generate_hadd_jobs(df, source_folder="NID_source", target_folder="NID_target"):
+    """
+    Generates one merge job for each row in the DataFrame. The output is 'target_folder/reco_runX-Y_3D.root'
+    where X is the start run and Y is the stop run, the inputs are the files 'source_folder/reco_runXXXXX_3D.root'
+    of every run from 'StartRun' to 'StopRun'.
+
+    Parameters:
+    - df: The DataFrame containing the 'StartRun' and 'StopRun' columns.
+    - source_folder: The folder path to prepend to each individual run file.
+    - target_folder: The folder path to prepend to the combined hadd file.
+
+    Returns:
+    - A list of (target_path, input_paths) tuples, one for each row.
+    """
+    jobs = []
+    for index, row in df.iterrows():
+        start_run = int(row['StartRun'])
+        stop_run = int(row['StopRun'])
+        target_path = f"{target_folder}/reco_run{start_run}-{stop_run}_3D.root"
+        input_paths = [f'{source_folder}/reco_run{run}_3D.root' for run in range(start_run, stop_run + 1)]
+        jobs.append((target_path, input_paths))
+    return jobs
+
+LOGBOOK_COLUMNS = ['Run number start', 'Run number end', 'comments', 'He/CF4 ratio', 'Requested_Drift_field_V_cm',
+                   'Position of source [hole]', 'Sensor inside [T;P;H;--] [K,Pa,%,-]']
+
+def parse_logbook(logbook_path):
+    """
+    Reads only the needed columns of the excel logbook and splits the ';' and '/' separated fields into typed columns.
+
+    Parameters:
+    - logbook_path: Path to the excel logbook.
+
+    Returns:
+    - A DataFrame with the run range, the comments, the drift field, the source position, the gas mixture
+      ('helium', 'CF4', 'SF6') and the sensor readings ('Temperature (K)', 'Pressure (Pa)', 'Humidity (%)', 'VOC (-)').
+    """
+    df = pd.read_excel(logbook_path, usecols=LOGBOOK_COLUMNS)
+    logbook = pd.DataFrame({
+        'Run number start': pd.to_numeric(df['Run number start'], errors='coerce').astype('Int64'),
+        'Run number end': pd.to_numeric(df['Run number end'], errors='coerce').astype('Int64'),
+        'comments': df['comments'].astype('string'),
+        'Requested_Drift_field_V_cm': pd.to_numeric(df['Requested_Drift_field_V_cm'], errors='coerce'),
+        'Position of source [hole]': pd.to_numeric(df['Position of source [hole]'], errors='coerce'),
+    })
+    #Gas
+    gas_columns = ['helium', 'CF4', 'SF6']
+    temp_gas = df["He/CF4 ratio"].astype('string').str.split('/', expand=True).reindex(columns=range(len(gas_columns)))
+    temp_gas.columns = gas_columns
+    #enviromental variable column
+    sensor_columns = ['Temperature (K)', 'Pressure (Pa)', 'Humidity (%)', 'VOC (-)']
+    temp_df = df['Sensor inside [T;P;H;--] [K,Pa,%,-]'].astype('string').str.split(';', expand=True).reindex(columns=range(len(sensor_columns)))
+    temp_df.columns = sensor_columns
+    for column in gas_columns + sensor_columns:
+        source = temp_gas if column in gas_columns else temp_df
+        logbook[column] = pd.to_numeric(source[column].str.strip(), errors='coerce').astype(float)
+    return logbook
+
+def load_logbook(logbook_path, cache_dir=None):
+    """
+    Loads the logbook with parse_logbook, caching the result as Parquet.
+    The cache is reused without opening the excel file if its modification time and size did not change,
+    otherwise the hash of the file decides if it has to be parsed again. The cache is skipped when pyarrow is not installed.
+
+    Parameters:
+    - logbook_path: Path to the excel logbook.
+    - cache_dir: Folder of the cache (default '.logbook_cache' next to the logbook), False disables the cache.
+
+    Returns:
+    - The DataFrame returned by parse_logbook.
+    """
+    if cache_dir is False:
+        return parse_logbook(logbook_path)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(logbook_path)), '.logbook_cache')
+    cache_path = os.path.join(cache_dir, os.path.basename(logbook_path) + '.parquet')
+    key_path = os.path.join(cache_dir, os.path.basename(logbook_path) + '.json')
+    stat = os.stat(logbook_path)
+    key = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+    cached_key = None
+    if os.path.exists(cache_path) and os.path.exists(key_path):
+        with open(key_path) as f:
+            cached_key = json.load(f)
+    if cached_key is not None and (cached_key['mtime_ns'], cached_key['size']) != (key['mtime_ns'], key['size']):
+        # Touched but maybe not modified, compare the content
+        key['sha1'] = file_hash(logbook_path)
+        if cached_key.get('sha1') != key['sha1']:
+            cached_key = None
+    try:
+        if cached_key is not None:
+            logbook = pd.read_parquet(cache_path)
+            if 'sha1' in key:
+                with open(key_path, 'w') as f:
+                    json.dump(key, f)
+            return logbook
+        logbook = parse_logbook(logbook_path)
+        key['sha1'] = key.get('sha1') or file_hash(logbook_path)
+        os.makedirs(cache_dir, exist_ok=True)
+        logbook.to_parquet(cache_path)
+        with open(key_path, 'w') as f:
+            json.dump(key, f)
+    except ImportError:
+        print("pyarrow not installed, the logbook is not cached")
+        logbook = parse_logbook(logbook_path)
+    return logbook
+
+def select_runs(df, str_condition='ED', verbose=False):
+    """
+    Selects the logbook rows whose comments contain str_condition and builds the table of the runs to merge.
+
+    Parameters:
+    - df: The logbook DataFrame returned by load_logbook.
+    - str_condition: String the comments of the selected rows must contain.
+    - verbose: Print the selection mask.
+
+    Returns:
+    - A DataFrame with the 'StartRun' and 'StopRun' columns followed by the run conditions, one row per selected row.
+    """
+    #Select NIF data
+    NID_condition=df['comments'].str.contains(str_condition, na=False)
+    NID_selected=df[NID_condition]
+    if verbose:
+        print("Selected rows only if they contain:",str_condition)
+        print("mask is:",NID_condition)
+
+    #start stop column
+    start = NID_selected['Run number start'].astype(int)
+    stop = NID_selected['Run number end'].astype(int)
+    #Drift filed column
+    driftField=NID_selected["Requested_Drift_field_V_cm"]
+    #Position column
+    position=NID_selected["Position of source [hole]"]
+    #enviromental variable and gas columns are already split by load_logbook
+
+    # Combine the individual series and DataFrame into a new DataFrame
+    new_df = pd.DataFrame({
+        'StartRun': start,
+        'StopRun': stop,
+        'He(%)': NID_selected["helium"],
+        'CF4(%)': NID_selected["CF4"],
+        'SF6(%)': NID_selected["SF6"],
+        'Drift Field (Vcm)': driftField,
+        'Position': position,
+        'Temperature (K)': NID_selected['Temperature (K)'],
+        'Pressure (Pa)': NID_selected['Pressure (Pa)'],
+        'Humidity (%)': NID_selected['Humidity (%)'],
+        'VOC (-)': NID_selected['VOC (-)']
+    })
+    return new_df.reset_index(drop=True)
+
+def run(args):
+    """
+    Runs the logbook subcommand: selects the runs from the excel logbook, merges them and appends the run conditions.
+
+    Parameters:
+    - args: The parsed command line arguments.
+    """
+    instrumentation = Instrumentation()
+    with instrumentation.stage('logbook_parsing'):
+        df = load_logbook(args.logbook)
+    with instrumentation.stage('selection'):
+        runs_df = select_runs(df, verbose=args.verbose is not None)
+    if args.verbose is not None: print(runs_df)
+
+    # Save the DataFrame to a CSV file
+    runs_df.to_csv('df_out.csv', index=False)
+
+    # Merged files of each row, more than one when the row is split into parts
+    row_jobs = [split_job(job, args.max_bytes, args.max_entries)
+                for job in generate_hadd_jobs(runs_df, args.source, args.target)]
+
+    # Values appended to each merged file, used by the manifest to detect changes
+    env_columns = [col for col in runs_df.columns if col not in ['StartRun', 'StopRun']]
+    job_env = {}
+    if args.environment is not None:
+        for (index, row), parts in zip(runs_df.iterrows(), row_jobs):
+            for target_path, input_paths in parts:
+                job_env[target_path] = {col: row[col] for col in env_columns}
+
+    def annotate(job):
+        # Called before the merged file is recorded in the manifest, so a file is never recorded without its branches.
+        # Measured apart from the merge, which goes on in the other threads meanwhile
+        with instrumentation.accumulate('annotation', output_files=1):
+            annotated = annotate_root_file(job[0], job_env[job[0]])
+        if not annotated:
+            raise RuntimeError(f"Cannot append the enviromental variables to {job[0]}")
+
+    if args.compress is not None:
+        hadd_jobs = [part for parts in row_jobs for part in parts]
+        merge_incrementally(hadd_jobs, args.target, env=job_env, rebuild=args.rebuild, resume=args.resume,
+                            verbose=args.verbose is not None, instrumentation=instrumentation,
+                            on_done=annotate if args.environment is not None else None, workers=args.workers,
+                            hadd_jobs=args.hadd_jobs, backend=args.backend, chunk_size=args.chunk_size,
+                            compression=args.compression)
+
+    elif args.environment is not None:
+        with instrumentation.stage('annotation', output_files=0) as info:
+            # Append the variables to the merged files already in the target folder
+            print("Appending enviromental variables")
+            for root_file_path in tqdm(job_env):
+                # Check if file exists
+                if os.path.exists(root_file_path):
+                    # Add all the branches to the ROOT file in one update
+                    annotate_root_file(root_file_path, job_env[root_file_path])
+                    info['output_files'] += 1
+                else:
+                    print(f"File not found: {root_file_path}")
+
+    write_instrumentation(instrumentation, args.report, args.trace)
@@ -0,0 +1,940 @@
+import os
+import json
+import hashlib
+import time
+import signal
+import resource
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from subprocess import Popen, CalledProcessError, PIPE, STDOUT
+from tqdm import tqdm
+from .instrumentation import rusage_info
+
+MERGE_BACKENDS = ('hadd', 'root')
+# ROOT compression algorithm number and default level of each algorithm
+COMPRESSION_ALGORITHMS = {'zlib': (1, 1), 'lzma': (2, 7), 'lz4': (4, 4), 'zstd': (5, 5)}
+
+def compression_setting(value):
+    """
+    Parses a compression option of the merged files: 'keep' to keep the compression of the inputs,
+    so the baskets are copied without being recompressed, an algorithm with an optional level
+    ('zstd', 'lz4:4', 'lzma:9', see COMPRESSION_ALGORITHMS) or a ROOT setting (algorithm * 100 + level, e.g. 505).
+
+    Parameters:
+    - value: The option as a string.
+
+    Returns:
+    - 'keep' or the ROOT compression setting as an integer.
+    """
+    value = value.strip().lower()
+    if value == 'keep' or value.isdigit():
+        return value if value == 'keep' else int(value)
+    algorithm, _, level = value.partition(':')
+    if algorithm not in COMPRESSION_ALGORITHMS or (level and not level.isdigit()):
+        raise ValueError(f"Unknown compression {value}, use keep, a ROOT setting or one of "
+                         f"{', '.join(COMPRESSION_ALGORITHMS)} with an optional :level")
+    number, default_level = COMPRESSION_ALGORITHMS[algorithm]
+    return number * 100 + (int(level) if level else default_level)
+
+def file_hash(path, block_size=1 << 20):
+    """
+    Computes the SHA1 of a file, reading it in blocks.
+
+    Parameters:
+    - path: Path of the file.
+    - block_size: Number of bytes read at a time.
+
+    Returns:
+    - The hexadecimal digest.
+    """
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def job_input_bytes(job):
+    """
+    Computes the total size on disk of the input files of a merge job.
+    Missing inputs count as zero bytes, hadd will report them when the job runs.
+
+    Parameters:
+    - job: A (target_path, input_paths) tuple.
+
+    Returns:
+    - The summed size of the existing input files in bytes.
+    """
+    total = 0
+    for path in job[1]:
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            pass
+    return total
+
+def part_path(target_path, part):
+    """
+    Returns the name of the part-th output of a split merge job, 'reco_runX-Y_3D_partK.root' for 'reco_runX-Y_3D.root'.
+
+    Parameters:
+    - target_path: The output of the whole group.
+    - part: Number of the part, starting from 1.
+    """
+    root, extension = os.path.splitext(target_path)
+    return f"{root}_part{part}{extension}"
+
+def split_job(job, max_bytes=None, max_entries=None):
+    """
+    Splits a merge job whose inputs exceed max_bytes on disk or max_entries Events entries into parts
+    that respect the caps, keeping the order of the inputs. Filling each part with the next inputs as long as
+    they fit under both caps gives the smallest number of parts, then the caps are lowered as long as
+    they still give that number of parts, so the parts are balanced instead of leaving a small last one.
+    A single input larger than a cap gets a part of its own. The entries are read from the TTree metadata with uproot.
+
+    Parameters:
+    - job: A (target_path, input_paths) tuple.
+    - max_bytes: Maximum total size of the inputs of a part (None for no limit).
+    - max_entries: Maximum number of Events entries of a part (None for no limit).
+
+    Returns:
+    - A list of (target_path, input_paths) tuples, the job itself if it is small enough,
+      otherwise one job for each part with the output named by part_path.
+    """
+    target_path, input_paths = job
+    if not input_paths or (max_bytes is None and max_entries is None):
+        return [job]
+    limits = []
+    if max_bytes is not None:
+        limits.append(([os.path.getsize(path) if os.path.exists(path) else 0 for path in input_paths], max_bytes))
+    if max_entries is not None:
+        limits.append(([tree_entries(path) or 0 for path in input_paths], max_entries))
+
+    def fill(scale):
+        # Parts filled in order with the caps multiplied by scale
+        chunks = [[]]
+        totals = [0] * len(limits)
+        for i, path in enumerate(input_paths):
+            fits = all(total + weights[i] <= cap * scale for total, (weights, cap) in zip(totals, limits))
+            if chunks[-1] and not fits:
+                chunks.append([])
+                totals = [0] * len(limits)
+            chunks[-1].append(path)
+            totals = [total + weights[i] for total, (weights, cap) in zip(totals, limits)]
+        return chunks
+
+    n_parts = len(fill(1))
+    if n_parts == 1:
+        return [job]
+    # Bisect the smallest scale of the caps that still gives n_parts parts
+    low, high = 0.0, 1.0
+    for _ in range(30):
+        middle = (low + high) / 2
+        if len(fill(middle)) > n_parts:
+            low = middle
+        else:
+            high = middle
+    chunks = fill(high)
+    return [(part_path(target_path, k), chunk) for k, chunk in enumerate(chunks, 1)]
+
+def split_jobs(jobs, max_bytes=None, max_entries=None):
+    """
+    Runs split_job on every merge job.
+
+    Parameters:
+    - jobs: A list of (target_path, input_paths) tuples.
+    - max_bytes: Maximum total size of the inputs of a part (None for no limit).
+    - max_entries: Maximum number of Events entries of a part (None for no limit).
+
+    Returns:
+    - The list of jobs, the oversized ones replaced by their parts.
+    """
+    return [part for job in jobs for part in split_job(job, max_bytes, max_entries)]
+
+def format_size(n_bytes):
+    """
+    Formats a number of bytes for humans (e.g. '1.5 GB').
+    """
+    for unit in ['B', 'kB', 'MB', 'GB']:
+        if n_bytes < 1000:
+            return f"{n_bytes:.1f} {unit}"
+        n_bytes /= 1000
+    return f"{n_bytes:.1f} TB"
+
+def print_plan(jobs, verbose=False):
+    """
+    Prints the merge jobs with their number of inputs and the expected size of the output, the sum of the input sizes.
+    Nothing is opened, only the size of the files on disk is read.
+
+    Parameters:
+    - jobs: A list of (target_path, input_paths) tuples.
+    - verbose: Also print every input file.
+    """
+    total = 0
+    for target_path, input_paths in jobs:
+        size = job_input_bytes((target_path, input_paths))
+        missing = [path for path in input_paths if not os.path.exists(path)]
+        total += size
+        print(f"{target_path}: {len(input_paths)} inputs, ~{format_size(size)}"
+              + (f", {len(missing)} missing" if missing else ""))
+        if verbose:
+            for path in input_paths:
+                print(f"    {path}" + (" (missing)" if path in missing else ""))
+    print(f"{len(jobs)} merged files, ~{format_size(total)} in total")
+
+def manifest_path(target_folder):
+    """
+    Returns the path of the merge manifest kept next to the target folder ('target' -> 'target_manifest.json').
+
+    Parameters:
+    - target_folder: The folder containing the merged files.
+    """
+    return os.path.normpath(target_folder) + '_manifest.json'
+
+def load_manifest(path):
+    """
+    Loads the merge manifest, an empty one is returned if the file does not exist yet.
+
+    Parameters:
+    - path: Path of the JSON manifest.
+
+    Returns:
+    - A dictionary with an 'outputs' entry mapping each merged file to its inputs and environmental values.
+    """
+    if not os.path.exists(path):
+        return {'outputs': {}}
+    with open(path) as f:
+        return json.load(f)
+
+def save_manifest(path, manifest):
+    """
+    Writes the merge manifest, going through a temporary file so that an interrupted write does not corrupt it.
+
+    Parameters:
+    - path: Path of the JSON manifest.
+    - manifest: The manifest dictionary.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def input_signature(input_paths):
+    """
+    Describes the current state of the input files with their size and modification time.
+
+    Parameters:
+    - input_paths: List of the input files.
+
+    Returns:
+    - A list of [path, size, mtime_ns] entries, size and mtime are None for missing files.
+    """
+    signature = []
+    for path in input_paths:
+        try:
+            stat = os.stat(path)
+            signature.append([path, stat.st_size, stat.st_mtime_ns])
+        except OSError:
+            signature.append([path, None, None])
+    return signature
+
+def env_signature(env_data):
+    """
+    Converts the environmental values attached to an output into a JSON friendly form that can be compared between runs.
+
+    Parameters:
+    - env_data: A dictionary of environmental values (None if the output has none).
+    """
+    if env_data is None:
+        return None
+    return {str(key): str(value) for key, value in env_data.items()}
+
+def outdated_jobs(jobs, manifest, env=None):
+    """
+    Selects the merge jobs whose output must be rebuilt: the output is missing, it is not in the manifest,
+    its list of inputs changed, one of the inputs changed size or modification time, or the attached
+    environmental values changed.
+
+    Parameters:
+    - jobs: A list of (target_path, input_paths) tuples.
+    - manifest: The manifest loaded with load_manifest.
+    - env: Optional dictionary mapping each target_path to the environmental values attached to it.
+
+    Returns:
+    - The list of jobs to run.
+    """
+    env = env or {}
+    outdated = []
+    for target_path, input_paths in jobs:
+        entry = manifest['outputs'].get(target_path)
+        if (entry is None or not os.path.exists(target_path)
+                or entry['inputs'] != input_signature(input_paths)
+                or entry.get('env') != env_signature(env.get(target_path))):
+            outdated.append((target_path, input_paths))
+    return outdated
+
+def record_jobs(manifest, jobs, env=None, compression=None):
+    """
+    Stores the current state of the inputs of the merged jobs and the compression they were merged with in the manifest.
+
+    Parameters:
+    - manifest: The manifest loaded with load_manifest.
+    - jobs: A list of (target_path, input_paths) tuples that have just been merged.
+    - env: Optional dictionary mapping each target_path to the environmental values attached to it.
+    - compression: The compression of the merge, see compression_setting (None for the ROOT default).
+    """
+    env = env or {}
+    for target_path, input_paths in jobs:
+        manifest['outputs'][target_path] = {'inputs': input_signature(input_paths),
+                                            'env': env_signature(env.get(target_path)),
+                                            'compression': compression}
+
+def remove_stale_outputs(jobs, manifest, target_folder):
+    """
+    Removes from the target folder and from the manifest every file that is not an output of the current jobs.
+    The target folder is created if it does not exist.
+
+    Parameters:
+    - jobs: A list of (target_path, input_paths) tuples.
+    - manifest: The manifest loaded with load_manifest.
+    - target_folder: The folder containing the merged files.
+    """
+    targets = {os.path.normpath(target_path) for target_path, _ in jobs}
+    os.makedirs(target_folder, exist_ok=True)
+    for item in os.listdir(target_folder):
+        item_path = os.path.join(target_folder, item)
+        if os.path.isfile(item_path) and os.path.normpath(item_path) not in targets:
+            os.remove(item_path)
+    for target_path in list(manifest['outputs']):
+        if os.path.normpath(target_path) not in targets:
+            del manifest['outputs'][target_path]
+
+def resume_jobs(jobs, todo_jobs, workers=1):
+    """
+    Checks the outputs of the jobs already completed according to the manifest with validate_jobs
+    and adds the invalid ones to the jobs to run.
+
+    Parameters:
+    - jobs: A list of (target_path, input_paths) tuples.
+    - todo_jobs: The jobs that already have to run, from outdated_jobs.
+    - workers: Number of files checked at the same time.
+
+    Returns:
+    - The list of jobs to run.
+    """
+    todo_targets = {target_path for target_path, _ in todo_jobs}
+    completed = [job for job in jobs if job[0] not in todo_targets]
+    todo_jobs = list(todo_jobs)
+    for job, error in validate_jobs(completed, workers):
+        print(f"{job[0]} is not valid ({error}), merging it again")
+        todo_jobs.append(job)
+    return todo_jobs
+
+def merge_incrementally(jobs, target_folder, env=None, rebuild=False, resume=False, verbose=False, instrumentation=None,
+                        prepare=None, on_done=None, **merge_options):
+    """
+    Runs only the merge jobs whose output is out of date according to the manifest of the target folder.
+    Each job is recorded in the manifest as soon as its output is in place, so an interrupted merge
+    continues from the jobs not completed yet. Files of the target folder that are not outputs of the jobs
+    (like the partial files left by an interrupted merge) are removed.
+
+    Parameters:
+    - jobs: A list of (target_path, input_paths) tuples.
+    - target_folder: The folder containing the merged files.
+    - env: Optional dictionary mapping each target_path to the environmental values attached to it.
+    - rebuild: Ignore the manifest, empty the target folder and run every job.
+    - resume: Also check the number of events of the completed outputs and run again the invalid ones.
+    - verbose: Print the hadd command of each job.
+    - instrumentation: Optional Instrumentation measuring the merge.
+    - prepare: Optional function called with the jobs to run before merging them (e.g. to annotate their inputs),
+      returning the jobs that can actually run.
+    - on_done: Optional function called with each job once its output is in place, before it is recorded
+      in the manifest (e.g. to attach the environmental values to the output). If it raises, the job is not recorded.
+    - merge_options: Options of execute_merge_jobs (workers, hadd_jobs, backend, chunk_size, compression).
+
+    Returns:
+    - The list of jobs that have been run.
+    """
+    manifest_file = manifest_path(target_folder)
+    manifest = load_manifest(manifest_file)
+    if rebuild:
+        manifest = {'outputs': {}}
+        remove_stale_outputs([], manifest, target_folder)
+        save_manifest(manifest_file, manifest)
+    else:
+        remove_stale_outputs(jobs, manifest, target_folder)
+    todo_jobs = outdated_jobs(jobs, manifest, env)
+    if resume and not rebuild:
+        todo_jobs = resume_jobs(jobs, todo_jobs, merge_options.get('workers', 1))
+    print(f"{len(todo_jobs)} of {len(jobs)} merged files need to be rebuilt")
+    if prepare is not None:
+        todo_jobs = prepare(todo_jobs)
+    if verbose:
+        for target_path, input_paths in todo_jobs:
+            print(' '.join(hadd_command(target_path, input_paths, compression=merge_options.get('compression'))))
+
+    def journal(job):
+        if on_done is not None:
+            on_done(job)
+        record_jobs(manifest, [job], env, merge_options.get('compression'))
+        save_manifest(manifest_file, manifest)
+    execute_measured_merge_jobs(todo_jobs, instrumentation, on_done=journal, **merge_options)
+    return todo_jobs
+
+def annotate_root_file(root_file_path, env_data, tree_name="Events", friend_name="EnvParam"):
+    """
+    Writes all the environmental values into a ROOT file in a single update, as a friend tree of tree_name
+    with one entry for each of its entries (read them with Events->AddFriend("EnvParam")).
+    An existing friend tree with the same name is replaced, so running it twice does not leave extra cycles.
+
+    Parameters:
+    - root_file_path: Path to the ROOT file.
+    - env_data: A dictionary (or DataFrame row) with the branch names and their values, None values are written as 0.
+    - tree_name: Name of the TTree the friend tree is aligned with.
+    - friend_name: Name of the new TTree.
+
+    Returns:
+    - False if tree_name is not in the file, True otherwise.
+    """
+    import numpy as np
+    import uproot
+    with uproot.update(root_file_path) as root_file:
+        if tree_name not in root_file:
+            print(f"Tree {tree_name} not found in file {root_file_path}")
+            return False
+        n_entries = root_file[tree_name].num_entries
+        branches = {str(key): np.full(n_entries, 0.0 if value is None else float(value), dtype=np.float32)
+                    for key, value in dict(env_data).items()}
+        if friend_name in root_file:
+            del root_file[friend_name]
+        # mktree writes a TTree, assigning a dictionary would write an RNTuple that AddFriend cannot use
+        friend = root_file.mktree(friend_name, {key: np.float32 for key in branches})
+        friend.extend(branches)
+    return True
+
+def create_other_param_tree(root_file_path, env_data, tree_name="OtherParam"):
+    """
+    Create a new TTree named 'OtherParam' in the ROOT file and add environmental data as branches.
+    Any previous cycle of the tree is deleted first, so the file can be annotated again.
+
+    Parameters:
+    - root_file_path: Path to the ROOT file.
+    - env_data: A dictionary containing the environmental data.
+    - tree_name: The name of the new TTree to be created.
+    """
+    import ROOT  # Imported here so the hadd backend does not need PyROOT
+    from array import array
+    # Open the ROOT file in UPDATE mode
+    root_file = ROOT.TFile(root_file_path, "UPDATE")
+    if not root_file or root_file.IsZombie():
+        raise OSError(f"Cannot open {root_file_path}")
+    root_file.Delete(f"{tree_name};*")
+
+    # Create a new TTree
+    new_tree = ROOT.TTree(tree_name, tree_name)
+
+    # Create arrays to hold the data for the new branches
+    branches = {}
+    for key, value in env_data.items():
+        branches[key] = array('f', [float(value)])
+        new_tree.Branch(key, branches[key], f"{key}/F")
+
+    # Fill the new tree with the data
+    new_tree.Fill()
+
+    # Write changes and close the file
+    new_tree.Write("", ROOT.TObject.kOverwrite)
+    root_file.Close()
+
+def annotate_source_file(root_file_path, env_data):
+    """
+    Adds the OtherParam tree to one source file, returning the error instead of raising it.
+
+    Parameters:
+    - root_file_path: Path to the ROOT file.
+    - env_data: A dictionary containing the environmental data.
+
+    Returns:
+    - The path and None if it worked, or the path and the error message.
+    """
+    if not os.path.exists(root_file_path):
+        return root_file_path, "file not found"
+    try:
+        create_other_param_tree(root_file_path, env_data)
+    except Exception as e:
+        return root_file_path, str(e)
+    return root_file_path, None
+
+def annotate_source_files(tasks, workers=1):
+    """
+    Adds the OtherParam tree to many source files, with a pool of processes when workers is above one
+    (PyROOT is not thread safe). A failing file does not stop the others.
+
+    Parameters:
+    - tasks: A list of (root_file_path, env_data) tuples, the env_data already matched to the run.
+    - workers: Number of processes annotating files at the same time.
+
+    Returns:
+    - A list of (root_file_path, error message) for the files that could not be annotated.
+    """
+    errors = []
+    if workers <= 1:
+        results = (annotate_source_file(path, env_data) for path, env_data in tasks)
+        for root_file_path, error in tqdm(results, total=len(tasks), desc="Annotating sources"):
+            if error is not None:
+                errors.append((root_file_path, error))
+        return errors
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(annotate_source_file, path, env_data) for path, env_data in tasks]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Annotating sources"):
+            root_file_path, error = future.result()
+            if error is not None:
+                errors.append((root_file_path, error))
+    return errors
+
+def write_run_table(root_file_path, run_table, tree_name="OtherParam"):
+    """
+    Writes a per run table into a merged ROOT file in a single update, as a TTree with one entry per run.
+    The 'run_number' column is written as an integer branch, the key to match the runs,
+    every other column as a float branch. An existing tree with the same name is replaced.
+
+    Parameters:
+    - root_file_path: Path to the merged ROOT file.
+    - run_table: DataFrame with a 'run_number' column and one column for each value to store.
+    - tree_name: Name of the new TTree.
+    """
+    import numpy as np
+    import uproot
+    run_table = run_table.sort_values('run_number')
+    branches, types = {}, {}
+    for column in run_table.columns:
+        if column == 'run_number':
+            branches[column], types[column] = run_table[column].to_numpy(dtype=np.int32), np.int32
+        else:
+            values = run_table[column].apply(lambda value: 0.0 if value is None else float(value))
+            branches[str(column)], types[str(column)] = values.to_numpy(dtype=np.float32), np.float32
+    with uproot.update(root_file_path) as root_file:
+        if tree_name in root_file:
+            del root_file[tree_name]
+        # mktree writes a TTree like the OtherParam of the sources, assigning a dictionary would write an RNTuple
+        tree = root_file.mktree(tree_name, types)
+        tree.extend(branches)
+
+def hadd_command(target_path, input_paths, hadd_jobs=None, compression=None):
+    """
+    Builds the hadd argument list merging input_paths into target_path.
+
+    Parameters:
+    - target_path: The merged output file.
+    - input_paths: List of the files to merge.
+    - hadd_jobs: If given, number of processes hadd itself may use (hadd -j).
+    - compression: 'keep' to keep the compression of the first input (hadd -fk, the baskets are copied
+      without recompressing them), a ROOT compression setting (hadd -f505) or None for the hadd default.
+
+    Returns:
+    - The command as a list of arguments, ready to be run without a shell.
+    """
+    command = ['hadd']
+    if hadd_jobs is not None:
+        command += ['-j', str(hadd_jobs)]
+    if compression == 'keep':
+        command.append('-fk')
+    elif compression is not None:
+        command.append(f'-f{compression}')
+    return command + [target_path] + list(input_paths)
+
+def merge_root_files(target_path, input_paths, chunk_size=50, progress=None, compression=None):
+    """
+    Merges the input ROOT files into target_path in-process with ROOT.TFileMerger, without going through a shell.
+    The inputs are merged incrementally in chunks of chunk_size files, so only one chunk is open at a time.
+    TFileMerger merges a chunk in one call, so the progress moves one chunk at a time.
+
+    Parameters:
+    - target_path: The merged output file, recreated if it exists.
+    - input_paths: List of the files to merge.
+    - chunk_size: Maximum number of input files opened at the same time.
+    - progress: Optional function called with the path of each input file once its chunk has been merged
+      (a smaller chunk_size gives a finer progress).
+    - compression: 'keep' to use the compression of the first input, a ROOT compression setting or None for the default.
+    """
+    import ROOT  # Imported here so the hadd backend does not need PyROOT
+    missing = [path for path in input_paths if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"Missing inputs for {target_path}: {', '.join(missing)}")
+    if compression == 'keep':
+        first_file = ROOT.TFile.Open(input_paths[0])
+        compression = first_file.GetCompressionSettings()
+        first_file.Close()
+    merger = ROOT.TFileMerger(False, False)
+    merger.SetPrintLevel(0)
+    # Baskets are copied without recompressing them when the compression of the input matches the output
+    merger.SetFastMethod(True)
+    opened = (merger.OutputFile(target_path, "RECREATE") if compression is None
+              else merger.OutputFile(target_path, "RECREATE", compression))
+    if not opened:
+        raise OSError(f"Cannot create {target_path}")
+    try:
+        for start in range(0, len(input_paths), chunk_size):
+            chunk = input_paths[start:start + chunk_size]
+            for path in chunk:
+                if not merger.AddFile(path, False):
+                    raise OSError(f"Cannot open {path}")
+            # Merge the chunk into the output and release its input files
+            if not merger.PartialMerge(ROOT.TFileMerger.kAllIncremental):
+                raise RuntimeError(f"Merging {', '.join(chunk)} into {target_path} failed")
+            if progress is not None:
+                for path in chunk:
+                    progress(path)
+    finally:
+        merger.CloseOutputFile()
+
+def partial_path(target_path):
+    """
+    Returns the temporary path a merge job writes to, renamed to target_path only once the output is complete and valid.
+
+    Parameters:
+    - target_path: The merged output file.
+    """
+    root, extension = os.path.splitext(target_path)
+    return f"{root}.partial{extension}"
+
+def finish_output(job, partial):
+    """
+    Validates the partial output of a merge job and atomically renames it to the job target.
+    An invalid partial output is removed.
+
+    Parameters:
+    - job: The (target_path, input_paths) tuple.
+    - partial: The file the job has written, from partial_path.
+
+    Returns:
+    - None if the output is in place, otherwise the description of the problem.
+    """
+    target_path, input_paths = job
+    error = validate_output((partial, input_paths))
+    if error is not None:
+        os.remove(partial)
+        return error
+    os.replace(partial, target_path)
+    return None
+
+def merge_root_job(job, chunk_size=50, progress=None, compression=None):
+    """
+    Runs one merge job with merge_root_files into its partial path, then validates and renames the output.
+
+    Parameters:
+    - job: A (target_path, input_paths) tuple.
+    - chunk_size: Maximum number of input files opened at the same time.
+    - progress: Optional function called with the path of each input file once its chunk has been merged.
+    - compression: Compression of the output, see merge_root_files.
+    """
+    target_path, input_paths = job
+    partial = partial_path(target_path)
+    try:
+        merge_root_files(partial, input_paths, chunk_size, progress, compression)
+    except Exception:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    error = finish_output(job, partial)
+    if error is not None:
+        raise RuntimeError(f"Invalid merge of {target_path}: {error}")
+
+def merge_job_in_process(job, chunk_size=50, compression=None):
+    """
+    Runs one merge job with merge_root_job and collects its progress in a log,
+    one line per input written when its chunk is merged.
+
+    Parameters:
+    - job: A (target_path, input_paths) tuple.
+    - chunk_size: Maximum number of input files opened at the same time.
+    - compression: Compression of the output, see merge_root_files.
+
+    Returns:
+    - The job, the text of its log, its start and stop time.perf_counter(), the process id of the worker
+      and the resource usage of the job (see rusage_info, the peak memory is the one of the worker).
+    """
+    target_path, input_paths = job
+    lines = []
+    start, before = time.perf_counter(), resource.getrusage(resource.RUSAGE_SELF)
+    merge_root_job(job, chunk_size, progress=lambda path: lines.append(f"[{len(lines) + 1}/{len(input_paths)}] {path}"),
+                   compression=compression)
+    usage = rusage_info(resource.getrusage(resource.RUSAGE_SELF), before)
+    return job, '\n'.join(lines), start, time.perf_counter(), os.getpid(), usage
+
+def tree_entries(root_file_path, tree_name="Events"):
+    """
+    Reads the number of entries of a TTree from its metadata with uproot, without reading any event.
+
+    Parameters:
+    - root_file_path: Path to the ROOT file.
+    - tree_name: Name of the TTree.
+
+    Returns:
+    - The number of entries, or None if uproot is missing or the tree cannot be read.
+    """
+    try:
+        import uproot
+        with uproot.open(root_file_path) as root_file:
+            return root_file[tree_name].num_entries
+    except Exception:
+        return None
+
+def validate_output(job, tree_name="Events"):
+    """
+    Checks that a merged file has as many tree_name entries as all its inputs together,
+    reading only the TTree metadata with uproot.
+
+    Parameters:
+    - job: A (target_path, input_paths) tuple, target_path being the file to check.
+    - tree_name: Name of the TTree.
+
+    Returns:
+    - None if the file is valid (or uproot is not installed), otherwise the description of the problem.
+    """
+    try:
+        import uproot  # noqa: F401  Without uproot the outputs are not validated
+    except ImportError:
+        return None
+    target_path, input_paths = job
+    entries = tree_entries(target_path, tree_name)
+    if entries is None:
+        return f"cannot read {tree_name} of {target_path}"
+    expected = 0
+    for path in input_paths:
+        input_entries = tree_entries(path, tree_name)
+        if input_entries is None:
+            return f"cannot read {tree_name} of {path}"
+        expected += input_entries
+    if entries != expected:
+        return f"{entries} {tree_name} entries instead of {expected}"
+    return None
+
+def validate_jobs(jobs, workers=1):
+    """
+    Runs validate_output on the outputs of the jobs in a pool of threads.
+
+    Parameters:
+    - jobs: A list of (target_path, input_paths) tuples.
+    - workers: Number of files checked at the same time.
+
+    Returns:
+    - A list of (job, error) tuples, one for each invalid output.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        errors = list(executor.map(validate_output, jobs))
+    return [(job, error) for job, error in zip(jobs, errors) if error is not None]
+
+def record_merge_job(instrumentation, job, start, stop, thread=None, compression=None, usage=None):
+    """
+    Stores in the instrumentation the measurement of a finished merge job, with its input and output sizes and events.
+
+    Parameters:
+    - instrumentation: The Instrumentation collecting the measurements (nothing is done if None).
+    - job: The (target_path, input_paths) tuple.
+    - start: time.perf_counter() when the job started.
+    - stop: time.perf_counter() when the job ended.
+    - thread: Identifier of the worker that ran the job (default the current thread).
+    - compression: The compression of the merge, see compression_setting.
+    - usage: Optional CPU time, peak memory and block I/O of the job, from rusage_info.
+    """
+    if instrumentation is None:
+        return
+    target_path, input_paths = job
+    output_bytes = os.path.getsize(target_path) if os.path.exists(target_path) else 0
+    instrumentation.record_job(target_path, start, stop, thread=thread, input_files=len(input_paths),
+                               input_bytes=job_input_bytes(job), output_bytes=output_bytes,
+                               events=tree_entries(target_path), compression=compression, **(usage or {}))
+
+def execute_measured_merge_jobs(jobs, instrumentation=None, **merge_options):
+    """
+    Runs execute_merge_jobs as the 'merging' stage of the instrumentation, with the number of input and output
+    files and the events written by the jobs.
+
+    Parameters:
+    - jobs: A list of (target_path, input_paths) tuples.
+    - instrumentation: The Instrumentation of the run (None runs the jobs without measuring them).
+    - merge_options: Options of execute_merge_jobs (workers, hadd_jobs, backend, chunk_size, compression, on_done).
+    """
+    if instrumentation is None:
+        execute_merge_jobs(jobs, **merge_options)
+        return
+    with instrumentation.stage('merging', input_files=sum(len(input_paths) for _, input_paths in jobs),
+                               output_files=len(jobs), compression=merge_options.get('compression')) as info:
+        first_job = len(instrumentation.jobs)
+        execute_merge_jobs(jobs, instrumentation=instrumentation, **merge_options)
+        info['events'] = sum(job.get('events') or 0 for job in instrumentation.jobs[first_job:])
+
+def execute_merge_jobs(jobs, workers=1, hadd_jobs=None, backend='hadd', chunk_size=50, compression=None, instrumentation=None,
+                       on_done=None):
+    """
+    Runs the merge jobs with the selected backend, see execute_hadd_jobs and execute_root_merge_jobs.
+    Each job writes to its partial_path, the output is renamed to the target only after validate_output
+    found in it the events of all the inputs, so a target file is always complete.
+
+    Parameters:
+    - jobs: A list of (target_path, input_paths) tuples.
+    - workers: Maximum number of merges running at the same time.
+    - hadd_jobs: If given, number of processes each hadd may use (hadd -j), only for the hadd backend.
+    - backend: 'hadd' to run the hadd command line tool, 'root' to merge in-process with ROOT.TFileMerger.
+    - chunk_size: Maximum number of input files opened at the same time, only for the root backend.
+    - compression: Compression of the merged files, see compression_setting (None for the ROOT default).
+    - instrumentation: Optional Instrumentation measuring each job.
+    - on_done: Optional function called with each job once its output is in place, from the calling thread.
+    """
+    if backend == 'hadd':
+        execute_hadd_jobs(jobs, workers, hadd_jobs, instrumentation, on_done, compression)
+    elif backend == 'root':
+        execute_root_merge_jobs(jobs, workers, chunk_size, instrumentation, on_done, compression)
+    else:
+        raise ValueError(f"Unknown merge backend {backend}, use one of {', '.join(MERGE_BACKENDS)}")
+
+def execute_hadd_jobs(jobs, workers=1, hadd_jobs=None, instrumentation=None, on_done=None, compression=None):
+    """
+    Runs the hadd merge jobs concurrently on a bounded pool of workers.
+    The jobs with the largest total input size are started first so that a long merge does not end up last.
+    The output of each job is captured and printed in one block when the job ends.
+    If a job fails, or on_done raises, the jobs still waiting are cancelled, the running ones are terminated
+    and the error is re-raised.
+    Each hadd is reaped by its worker with os.wait4, which gives its own CPU time, peak memory and block I/O.
+    A process is registered until it is reaped, and it is only signalled while it is registered, under the same lock:
+    an exited hadd stays a zombie until then, so its pid cannot have been reused by another process.
+
+    Parameters:
+    - jobs: A list of (target_path, input_paths) tuples.
+    - workers: Maximum number of hadd processes running at the same time.
+    - hadd_jobs: If given, number of processes each hadd may use (hadd -j).
+    - instrumentation: Optional Instrumentation measuring each job.
+    - on_done: Optional function called with each job once its output is in place.
+    - compression: Compression of the merged files, see hadd_command.
+    """
+    ordered = sorted(jobs, key=job_input_bytes, reverse=True)
+    print_lock = threading.Lock()
+    process_lock = threading.Lock()
+    running = set()
+    failed = threading.Event()
+
+    def run_job(job):
+        partial = partial_path(job[0])
+        command = hadd_command(partial, job[1], hadd_jobs, compression)
+        if failed.is_set():
+            return job, None, None
+        if os.path.exists(partial):
+            os.remove(partial)  # hadd refuses to overwrite a leftover of an interrupted merge
+        start = time.perf_counter()
+        with process_lock:
+            if failed.is_set():
+                return job, None, None
+            process = Popen(command, stdout=PIPE, stderr=STDOUT, text=True)
+            running.add(process.pid)
+        try:
+            output = process.stdout.read()
+        finally:
+            process.stdout.close()
+            # Wait for the exit without reaping, then reap under the lock so that stop_running never signals a reaped pid
+            if hasattr(os, 'waitid'):
+                os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+            with process_lock:
+                running.discard(process.pid)
+                _, status, child_usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            if os.path.exists(partial):
+                os.remove(partial)
+            error = CalledProcessError(process.returncode, command, output=output)
+        else:
+            # Validated in the worker thread, so the checks run in parallel like the merges
+            invalid = finish_output(job, partial)
+            error = None if invalid is None else RuntimeError(f"Invalid merge of {job[0]}: {invalid}")
+        if error is None:
+            record_merge_job(instrumentation, job, start, time.perf_counter(), compression=compression,
+                             usage=rusage_info(child_usage))
+        with print_lock:
+            print(f"Executed: hadd {job[0]} ({len(job[1])} inputs)")
+            print(output)
+        return job, error, output
+
+    def stop_running(pending):
+        failed.set()
+        for other in pending:
+            other.cancel()
+        with process_lock:
+            for pid in running:
+                os.kill(pid, signal.SIGTERM)
+
+    error = None
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        pending = {executor.submit(run_job, job) for job in ordered}
+        with tqdm(total=len(pending), desc="Executing commands") as progress:
+            # Drained to the end, so the jobs that complete while the batch is stopping are recorded too
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.cancelled():
+                        continue
+                    job, job_error, output = future.result()
+                    progress.update(1)
+                    if job_error is None and output is not None and on_done is not None:
+                        try:
+                            on_done(job)
+                        except Exception as e:
+                            job_error = e
+                    if job_error is not None and error is None:
+                        # Stop the whole batch on the first failure
+                        stop_running(pending)
+                        print(f"Error merging {job[0]}: {job_error}")
+                        error = job_error
+    if error is not None:
+        raise error  # Re-raise the exception to stop the script
+
+def execute_root_merge_jobs(jobs, workers=1, chunk_size=50, instrumentation=None, on_done=None, compression=None):
+    """
+    Runs the merge jobs in-process with merge_root_job, the largest jobs first.
+    With more than one worker the jobs run in a pool of processes, since PyROOT is not thread safe,
+    and the log of each job is printed in one block when the job ends.
+    If a job fails, or on_done raises, the jobs still waiting are cancelled and the error is re-raised.
+
+    Parameters:
+    - jobs: A list of (target_path, input_paths) tuples.
+    - workers: Maximum number of merges running at the same time.
+    - chunk_size: Maximum number of input files opened at the same time by each merge.
+    - instrumentation: Optional Instrumentation measuring each job.
+    - on_done: Optional function called with each job once its output is in place.
+    - compression: Compression of the merged files, see merge_root_files.
+    """
+    ordered = sorted(jobs, key=job_input_bytes, reverse=True)
+    if workers <= 1:
+        for job in ordered:
+            start, before = time.perf_counter(), resource.getrusage(resource.RUSAGE_SELF)
+            with tqdm(total=len(job[1]), desc=f"Merging {os.path.basename(job[0])}") as progress:
+                merge_root_job(job, chunk_size, progress=lambda path: progress.update(1), compression=compression)
+            record_merge_job(instrumentation, job, start, time.perf_counter(), compression=compression,
+                             usage=rusage_info(resource.getrusage(resource.RUSAGE_SELF), before))
+            if on_done is not None:
+                on_done(job)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(merge_job_in_process, job, chunk_size, compression) for job in ordered}
+        with tqdm(total=len(pending), desc="Merging") as progress:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        job, log, start, stop, pid, usage = future.result()
+                    except Exception:
+                        # Stop the whole batch on the first failure
+                        for other in pending:
+                            other.cancel()
+                        raise
+                    progress.update(1)
+                    record_merge_job(instrumentation, job, start, stop, thread=pid, compression=compression, usage=usage)
+                    if on_done is not None:
+                        try:
+                            on_done(job)
+                        except Exception:
+                            for other in pending:
+                                other.cancel()
+                            raise
+                    print(f"Merged {job[0]} ({len(job[1])} inputs)")
+                    print(log)
@@ -0,0 +1,396 @@
+import pandas as pd
+from tqdm import tqdm
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from .history import MANGO_SENSOR_COLUMNS, read_mhist, HistoryStore
+from .merging import merge_incrementally, split_job, write_run_table, annotate_source_files
+from .instrumentation import Instrumentation, write_instrumentation
+
+def generate_hadd_jobs(grouped_df, source_folder="source", target_folder="target"):
+    """
+    Generates one merge job for each row in the grouped DataFrame. The output is 'target_folder/reco_runX-Y_3D.root'
+    where X is the smallest run number and Y is the largest run number in the 'run_number' list,
+    the inputs are the files 'source_folder/reco_runXXXXX_3D.root' of every run in the list,
+    or the files of the optional 'path' (list) column, like the one of the run catalog, where they are known.
+
+    Parameters:
+    - grouped_df: The grouped DataFrame containing 'HOLE_number', 'DRIFT_V', and 'run_number' (list) columns.
+    - source_folder: The folder path to prepend to each individual run file.
+    - target_folder: The folder path to prepend to the combined hadd file.
+
+    Returns:
+    - A list of (target_path, input_paths) tuples, one for each row.
+    """
+    jobs = []
+    for index, row in grouped_df.iterrows():
+        run_numbers = sorted(row['run_number'])
+        start_run = run_numbers[0]
+        stop_run = run_numbers[-1]
+        target_path = f"{target_folder}/reco_run{start_run}-{stop_run}_3D.root"
+        known_paths = dict(zip(row['run_number'], row['path'])) if 'path' in grouped_df.columns else {}
+        input_paths = [known_paths[run] if pd.notna(known_paths.get(run)) else f'{source_folder}/reco_run{run}_3D.root'
+                       for run in run_numbers]
+        jobs.append((target_path, input_paths))
+    return jobs
+def parse_env_times(env_df, time_column, time_format=None, dayfirst=False):
+    """
+    Parse the time column of an environmental DataFrame once and return a copy sorted by time.
+    Rows whose time cannot be parsed are dropped.
+
+    Parameters:
+    - env_df: DataFrame containing the environmental data.
+    - time_column: Name of the column holding the sample times.
+    - time_format: Optional strftime format of the time column (None lets pandas infer it).
+    - dayfirst: Passed to pd.to_datetime when the format is inferred.
+
+    Returns:
+    - A new DataFrame with a datetime time column, sorted and without unparsable rows.
+    """
+    env_df = env_df.copy()
+    times = env_df[time_column].astype(str).str.strip()
+    env_df[time_column] = pd.to_datetime(times, format=time_format, dayfirst=dayfirst, errors='coerce')
+    env_df = env_df.dropna(subset=[time_column])
+    return env_df.sort_values(time_column, kind='mergesort').reset_index(drop=True)
+def join_nearest_env_data(runs_df, env_df, time_column, start_column='start_time', start_format=None,
+                          start_dayfirst=False, tolerance=None, direction='nearest'):
+    """
+    Match every run to an environmental sample in a single as-of join.
+    The environmental data must already be parsed and sorted with parse_env_times.
+
+    Parameters:
+    - runs_df: DataFrame with one row per run, containing the start_column.
+    - env_df: Sorted environmental DataFrame returned by parse_env_times.
+    - time_column: Name of the time column in env_df.
+    - start_column: Name of the run start time column in runs_df.
+    - start_format: Optional strftime format of the start_column.
+    - start_dayfirst: Passed to pd.to_datetime when start_format is not given.
+    - tolerance: Maximum allowed distance between run start and sample, in seconds (None means unlimited).
+    - direction: 'nearest', 'backward' (last sample before the start) or 'forward' (first sample after it).
+
+    Returns:
+    - A DataFrame aligned with runs_df (same index) holding the environmental columns of the matched sample.
+      Runs without a sample inside the tolerance get NaN values.
+    """
+    if direction not in ('nearest', 'backward', 'forward'):
+        raise ValueError(f"Unknown direction {direction}, use nearest, backward or forward")
+    start_times = pd.to_datetime(runs_df[start_column], format=start_format, dayfirst=start_dayfirst)
+    # Both keys must share the same datetime resolution for merge_asof
+    left = pd.DataFrame({'_start': start_times.to_numpy(dtype='datetime64[ns]'), '_row': np.arange(len(runs_df))})
+    left = left.sort_values('_start', kind='mergesort')
+    right = env_df.rename(columns={time_column: '_start'})
+    right['_start'] = right['_start'].astype('datetime64[ns]')
+    if tolerance is not None:
+        tolerance = pd.Timedelta(seconds=tolerance)
+    matched = pd.merge_asof(left, right, on='_start', direction=direction, tolerance=tolerance)
+    matched = matched.sort_values('_row').drop(columns=['_start', '_row'])
+    matched.index = runs_df.index
+    return matched
+def window_env_stats(runs_df, env_df, time_column, start_column='start_time', stop_column='stop_time',
+                     time_format=None, dayfirst=False):
+    """
+    Compute, for every run, the mean, min, max, std and number of samples of each environmental column
+    between the run start and stop, for all the runs at once with searchsorted and cumulative sums.
+    The environmental data must already be parsed and sorted with parse_env_times.
+
+    Parameters:
+    - runs_df: DataFrame with one row per run, containing the start_column and stop_column.
+    - env_df: Sorted environmental DataFrame returned by parse_env_times.
+    - time_column: Name of the time column in env_df.
+    - start_column: Name of the run start time column in runs_df.
+    - stop_column: Name of the run stop time column in runs_df.
+    - time_format: Optional strftime format of the start and stop columns.
+    - dayfirst: Passed to pd.to_datetime when time_format is not given.
+
+    Returns:
+    - A DataFrame aligned with runs_df (same index) with the columns '<column>_mean', '<column>_min', '<column>_max',
+      '<column>_std' and '<column>_n' for each environmental column. Runs without samples get NaN and a count of 0.
+    """
+    start = pd.to_datetime(runs_df[start_column], format=time_format, dayfirst=dayfirst).to_numpy(dtype='datetime64[ns]')
+    stop = pd.to_datetime(runs_df[stop_column], format=time_format, dayfirst=dayfirst).to_numpy(dtype='datetime64[ns]')
+    times = env_df[time_column].to_numpy(dtype='datetime64[ns]')
+    stats = {}
+    for column in env_df.columns:
+        if column == time_column:
+            continue
+        values = pd.to_numeric(env_df[column], errors='coerce').to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        column_times, values = times[valid], values[valid]
+        first = np.searchsorted(column_times, start, side='left')
+        last = np.searchsorted(column_times, stop, side='right')
+        count = np.maximum(last - first, 0)
+        # Shift the values before summing the squares to keep the precision on large values (pressures)
+        shifted = values - (values[0] if len(values) else 0.0)
+        sums = np.concatenate([[0.0], np.cumsum(shifted)])
+        squares = np.concatenate([[0.0], np.cumsum(shifted ** 2)])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            window_sum = sums[last] - sums[first]
+            mean = window_sum / count
+            variance = (squares[last] - squares[first] - window_sum * mean) / (count - 1)
+            std = np.sqrt(np.maximum(variance, 0.0))
+        # reduceat on (first, last) pairs gives the extremes of each window, a sentinel makes last always valid
+        padded = np.append(values, np.nan)
+        bounds = np.stack([np.minimum(first, len(values)), np.minimum(last, len(values))], axis=1).ravel()
+        empty = count == 0
+        window_min = np.where(empty, np.nan, np.minimum.reduceat(padded, bounds)[::2])
+        window_max = np.where(empty, np.nan, np.maximum.reduceat(padded, bounds)[::2])
+        stats[f'{column}_mean'] = np.where(empty, np.nan, mean + (values[0] if len(values) else 0.0))
+        stats[f'{column}_min'] = window_min
+        stats[f'{column}_max'] = window_max
+        stats[f'{column}_std'] = np.where(count > 1, std, np.nan)
+        stats[f'{column}_n'] = count
+    return pd.DataFrame(stats, index=runs_df.index)
+
+def env_interpolation_table(env_df, time_column, timezone='Europe/Rome'):
+    """
+    Prepares the environmental data for interpolate_env: for each column the sample times in seconds since the epoch
+    and the values, sorted by time and without the missing values. Columns without any valid sample are left out.
+
+    Parameters:
+    - env_df: Environmental DataFrame returned by parse_env_times (or read_mhist with the time as a column).
+    - time_column: Name of the time column in env_df.
+    - timezone: Time zone of the naive history times (mhist prints the local time of the DAQ),
+      used to convert them to seconds since the epoch like the event timestamps.
+
+    Returns:
+    - A dictionary mapping each environmental column to a (times, values) tuple of float64 arrays.
+    """
+    env_df = env_df.sort_values(time_column)
+    times = pd.to_datetime(env_df[time_column])
+    if times.dt.tz is None:
+        try:
+            times = times.dt.tz_localize(timezone, ambiguous='infer', nonexistent='NaT')
+        except ValueError:
+            # The repeated hour at the end of the summer time cannot be told apart, its samples are dropped
+            times = times.dt.tz_localize(timezone, ambiguous='NaT', nonexistent='NaT')
+    times = times.dt.tz_convert('UTC')
+    has_time = times.notna().to_numpy()
+    seconds = times.dt.tz_localize(None).to_numpy(dtype='datetime64[ns]').astype(np.int64) / 1e9
+    table = {}
+    for column in env_df.columns:
+        if column == time_column:
+            continue
+        values = pd.to_numeric(env_df[column], errors='coerce').to_numpy(dtype=np.float64)
+        valid = has_time & ~np.isnan(values)
+        if not valid.any():
+            print(f"No valid samples of {column} in the history, it is not interpolated")
+            continue
+        table[column] = (seconds[valid], values[valid])
+    return table
+
+def interpolate_env(table, event_times):
+    """
+    Interpolates linearly every environmental column at the event times, all the events at once.
+    Events before the first or after the last sample of a column get NaN.
+
+    Parameters:
+    - table: The table returned by env_interpolation_table.
+    - event_times: Array of the event times in seconds since the epoch.
+
+    Returns:
+    - A dictionary mapping each environmental column to a float32 array aligned with event_times.
+    """
+    event_times = np.asarray(event_times, dtype=np.float64)
+    return {column: np.interp(event_times, times, values, left=np.nan, right=np.nan).astype(np.float32)
+            for column, (times, values) in table.items()}
+
+def write_event_env(root_file_path, table, time_branch="timestamp", tree_name="Events", friend_name="EventEnv",
+                    step_size=1_000_000):
+    """
+    Writes the environmental values interpolated at the time of each event as a friend tree of tree_name,
+    one entry for each of its entries (read them with Events->AddFriend("EventEnv")).
+    The event times are read and the friend tree is written in chunks of step_size entries,
+    so the memory does not depend on the number of events. An existing friend tree with the same name is replaced.
+
+    Parameters:
+    - root_file_path: Path to the ROOT file.
+    - table: The table returned by env_interpolation_table.
+    - time_branch: Branch of tree_name with the event time in seconds since the epoch.
+    - tree_name: Name of the TTree the friend tree is aligned with.
+    - friend_name: Name of the new TTree.
+    - step_size: Number of entries read and written at a time.
+    """
+    import uproot
+    with uproot.open(root_file_path) as source, uproot.update(root_file_path) as target:
+        if tree_name not in source:
+            raise KeyError(f"Tree {tree_name} not found in file {root_file_path}")
+        events = source[tree_name]
+        if time_branch not in events:
+            raise KeyError(f"Branch {time_branch} not found in {tree_name} of {root_file_path}")
+        if friend_name in target:
+            del target[friend_name]
+        friend = target.mktree(friend_name, {column: np.float32 for column in table})
+        for chunk in events.iterate([time_branch], step_size=step_size, library='np'):
+            friend.extend(interpolate_env(table, chunk[time_branch]))
+
+def write_event_env_files(paths, table, time_branch="timestamp", workers=1):
+    """
+    Runs write_event_env on many files in a pool of threads, a failing file does not stop the others.
+
+    Parameters:
+    - paths: List of ROOT file paths.
+    - table: The table returned by env_interpolation_table.
+    - time_branch: Branch of the Events tree with the event time.
+    - workers: Number of files written at the same time.
+
+    Returns:
+    - A list of (root_file_path, error message) for the files that could not be written.
+    """
+    def write(path):
+        if not os.path.exists(path):
+            return path, "file not found"
+        try:
+            write_event_env(path, table, time_branch)
+        except Exception as e:
+            return path, str(e)
+        return path, None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(tqdm(executor.map(write, paths), total=len(paths), desc="Per-event env"))
+    return [(path, error) for path, error in results if error is not None]
+
+def read_runlog(runlog_path):
+    """
+    Reads the Runlog downloaded from GRAFANA.
+
+    Parameters:
+    - runlog_path: Path to the Runlog CSV.
+
+    Returns:
+    - The Runlog DataFrame with integer run numbers and the 'HOLE_number' column.
+    """
+    df=pd.read_csv(runlog_path)
+    df["run_number"] = df["run_number"].astype(int)
+    # Apply the function to create a new column for HOLE number
+    df['HOLE_number'] = df['source_position']
+    return df
+def group_runs(df):
+    """
+    Groups the Runlog runs with the same source position and drift field.
+
+    Parameters:
+    - df: The Runlog DataFrame returned by read_runlog.
+
+    Returns:
+    - A DataFrame with the 'HOLE_number', 'DRIFT_V' and 'run_number' (list) columns, one row per group.
+    """
+    # Group by HOLE_number and DRIFT_V and get run_number values
+    return df.groupby(['HOLE_number', 'DRIFT_V'])['run_number'].apply(list).reset_index()
+def run(args):
+    """
+    Runs the runlog subcommand: matches the environmental data to every run of the Runlog, attaches it and merges the groups.
+
+    Parameters:
+    - args: The parsed command line arguments.
+    """
+    instrumentation = Instrumentation()
+    with instrumentation.stage('runlog_parsing'):
+        df = read_runlog(args.logbook)
+        grouped = group_runs(df)
+
+    print("Attaching env variables...")
+    with instrumentation.stage('history_parsing'):
+        if args.env:
+            # Read the environmental log data
+            env_log_df = pd.read_csv('env_log.csv', delimiter=";")
+            env_log_df = parse_env_times(env_log_df, 'Timestamp', time_format="%d/%m/%Y_%H-%M-%S")
+            env_time_column, runlog_format, runlog_dayfirst = 'Timestamp', None, True
+        else:
+            runlog_format, runlog_dayfirst = "%Y-%m-%d %H:%M:%S", False
+            env_time_column = 'Time'
+            if args.store is None:
+                # Read the mhist output (typed columns, cached after the first read) and put the time back as a column
+                env_log_df = read_mhist(args.history, columns=MANGO_SENSOR_COLUMNS).reset_index()
+            else:
+                # Take the history of the scan from the local store, adding the last dump and fetching the missing ranges
+                store = HistoryStore(args.store)
+                if os.path.exists(args.history):
+                    store.add(read_mhist(args.history, columns=MANGO_SENSOR_COLUMNS))
+                run_times = pd.to_datetime(df['start_time'], format=runlog_format)
+                if args.window or args.per_event:
+                    run_times = pd.concat([run_times, pd.to_datetime(df[args.stop_column], format=runlog_format)])
+                margin = pd.Timedelta(seconds=args.tolerance if args.tolerance is not None else 3600)
+                if args.fetch:
+                    store.update(run_times.min() - margin, run_times.max() + margin)
+                env_log_df = store.query(run_times.min() - margin, run_times.max() + margin).reset_index()
+
+    with instrumentation.stage('environment_join'):
+        # Find the nearest environmental data for all the runs at once
+        env_matched = join_nearest_env_data(df, env_log_df, env_time_column, start_format=runlog_format,
+                                            start_dayfirst=runlog_dayfirst, tolerance=args.tolerance, direction=args.direction)
+        if args.window:
+            # Add the statistics of each sensor over the run
+            env_stats = window_env_stats(df, env_log_df, env_time_column, stop_column=args.stop_column,
+                                         time_format=runlog_format, dayfirst=runlog_dayfirst)
+            env_matched = env_matched.join(env_stats)
+
+        # Collect the environmental data of every run
+        run_env = {}
+        for index, row in df.iterrows():
+            env_data = env_matched.loc[index].to_dict()
+            env_data['DRIFT_V'] = row['DRIFT_V']  # Add the DRIFT_V value to env_data
+            env_data['HOLE_number'] = row['source_position']  # Add the HOLE_number value to env_data
+            run_env[row['run_number']] = env_data
+
+    with instrumentation.stage('planning') as info:
+        # Oversized groups are split into parts, each part with the runs of its inputs
+        hadd_jobs, job_runs = [], []
+        for job, run_numbers in zip(generate_hadd_jobs(grouped, args.source, args.target), grouped['run_number']):
+            run_of = {f'{args.source}/reco_run{run}_3D.root': run for run in run_numbers}
+            for part in split_job(job, args.max_bytes, args.max_entries):
+                hadd_jobs.append(part)
+                job_runs.append([run_of[path] for path in part[1]])
+        # Environmental values attached to each output, used by the manifest to detect changes
+        job_env = {}
+        for (target_path, input_paths), run_numbers in zip(hadd_jobs, job_runs):
+            job_env[target_path] = {f"{run}.{key}": value for run in sorted(run_numbers) for key, value in run_env[run].items()}
+            job_env[target_path]['attach'] = 'output' if args.attach_to_output else 'source'
+            job_env[target_path]['event_env'] = args.time_branch if args.per_event else None
+
+        info['output_files'] = len(hadd_jobs)
+
+    if args.per_event:
+        env_table = env_interpolation_table(env_log_df, env_time_column, args.history_timezone)
+
+    def prepare(todo_jobs):
+        # Update the ROOT files of the groups to rebuild with the matched environmental data
+        # (with --attach-to-output the sources are left untouched and the table goes in the merged file)
+        if args.attach_to_output:
+            return todo_jobs
+        todo_targets = {target_path for target_path, input_paths in todo_jobs}
+        todo_runs = [run for (target_path, input_paths), run_numbers in zip(hadd_jobs, job_runs)
+                     if target_path in todo_targets for run in run_numbers]
+        with instrumentation.stage('annotation', output_files=len(todo_runs)):
+            annotation_tasks = [(os.path.join(args.source, f"reco_run{run}_3D.root"), run_env[run]) for run in todo_runs]
+            errors = annotate_source_files(annotation_tasks, workers=args.workers)
+        for root_file_path, error in errors:
+            print(f"Error annotating {root_file_path}: {error}")
+        if args.per_event:
+            # The EventEnv trees of the sources are merged by hadd like Events, so they stay aligned in the merged file
+            todo_paths = sorted({path for target_path, input_paths in todo_jobs for path in input_paths})
+            with instrumentation.stage('event_env', output_files=len(todo_paths)):
+                event_errors = write_event_env_files(todo_paths, env_table, args.time_branch, workers=args.workers)
+            for root_file_path, error in event_errors:
+                print(f"Error writing the per-event env of {root_file_path}: {error}")
+            errors += event_errors
+        # Groups with a source that could not be annotated are left for the next invocation
+        failed_paths = {root_file_path for root_file_path, error in errors}
+        return [job for job in todo_jobs if not failed_paths.intersection(job[1])]
+
+    group_runs_of = dict(zip((target_path for target_path, input_paths in hadd_jobs), job_runs))
+    def attach_to_output(job):
+        target_path = job[0]
+        # Measured apart from the merge, which goes on in the other threads meanwhile
+        with instrumentation.accumulate('annotation', output_files=1):
+            run_table = pd.DataFrame([{'run_number': run, **run_env[run]} for run in group_runs_of[target_path]])
+            write_run_table(target_path, run_table)
+        if args.per_event:
+            with instrumentation.accumulate('event_env', output_files=1):
+                write_event_env(target_path, env_table, args.time_branch)
+
+    merge_incrementally(hadd_jobs, args.target, env=job_env, rebuild=args.rebuild, resume=args.resume,
+                        verbose=args.verbose is True, instrumentation=instrumentation, prepare=prepare,
+                        on_done=attach_to_output if args.attach_to_output else None, workers=args.workers,
+                        hadd_jobs=args.hadd_jobs, backend=args.backend, chunk_size=args.chunk_size,
+                        compression=args.compression)
+    write_instrumentation(instrumentation, args.report, args.trace)
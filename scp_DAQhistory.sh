@@ -1,13 +1,22 @@
 #!/bin/bash
+# Usage: scp_DAQhistory.sh [START STOP] with START and STOP as YYMMDD[.HHMM[SS]]
+# If START and STOP are given the history is dumped on the remote machine before copying it
 
 # Variables
 REMOTE_USER="cygno01"
 REMOTE_HOST="172.17.19.155"
-REMOTE_COMMAND="/home/software//midas/bin/mhist -e MANGOSensors -s 240704.223544 -p 240705.210215"
+START="${1:-240704.223544}"
+STOP="${2:-240705.210215}"
+REMOTE_COMMAND="/home/software//midas/bin/mhist -e MANGOSensors -s ${START} -p ${STOP}"
 OUTPUT_FILE="history_output.csv"
 
+# Dump the history on the remote machine
+if [ $# -ge 2 ]; then
+    ssh ${REMOTE_USER}@${REMOTE_HOST} "${REMOTE_COMMAND} > ~/${OUTPUT_FILE}"
+fi
+
 # Copy the output file from the remote machine to the local machine
 scp ${REMOTE_USER}@${REMOTE_HOST}:~/${OUTPUT_FILE} .
 
 # Notify the user
-echo "Output has been copied to ${OUTPUT_FILE}"
\ No newline at end of file
+echo "Output has been copied to ${OUTPUT_FILE}"
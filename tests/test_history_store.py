@@ -0,0 +1,61 @@
+import os
+import pandas as pd
+import pytest
+from mango_merge.benchmark import generate_history
+from mango_merge.history import HistoryStore, read_mhist
+
+pytest.importorskip('pyarrow')
+
+def local_fetcher(folder, calls):
+    # Stand-in for the DAQ machine: writes an mhist dump of the range, one sample every 10 seconds
+    def fetch(start, stop):
+        calls.append((start, stop))
+        path = os.path.join(folder, f"dump{len(calls)}.csv")
+        generate_history(path, start, int((stop - start).total_seconds() // 10) + 1, seed=len(calls))
+        return path
+    return fetch
+
+def test_missing_ranges_are_the_gaps_of_the_coverage(tmp_path):
+    store = HistoryStore(tmp_path / 'store')
+    assert store.missing_ranges('2024-07-05 00:00', '2024-07-05 03:00') == [
+        (pd.Timestamp('2024-07-05 00:00'), pd.Timestamp('2024-07-05 03:00'))]
+    store.add_coverage('2024-07-05 00:00', '2024-07-05 01:00')
+    store.add_coverage('2024-07-05 02:00', '2024-07-05 03:00')
+    assert store.missing_ranges('2024-07-05 00:00', '2024-07-05 03:00') == [
+        (pd.Timestamp('2024-07-05 01:00'), pd.Timestamp('2024-07-05 02:00'))]
+    store.add_coverage('2024-07-05 00:30', '2024-07-05 02:30')
+    assert store.coverage() == [(pd.Timestamp('2024-07-05 00:00'), pd.Timestamp('2024-07-05 03:00'))]
+    assert store.missing_ranges('2024-07-05 00:00', '2024-07-05 03:00') == []
+
+def test_update_fetches_only_the_missing_ranges(tmp_path):
+    store, calls = HistoryStore(tmp_path / 'store'), []
+    fetch = local_fetcher(tmp_path, calls)
+    store.update(pd.Timestamp('2024-07-05 00:00'), pd.Timestamp('2024-07-05 02:00'), fetcher=fetch)
+    store.update(pd.Timestamp('2024-07-05 01:00'), pd.Timestamp('2024-07-05 04:00'), fetcher=fetch)
+    assert calls == [(pd.Timestamp('2024-07-05 00:00'), pd.Timestamp('2024-07-05 02:00')),
+                     (pd.Timestamp('2024-07-05 02:00'), pd.Timestamp('2024-07-05 04:00'))]
+    assert store.update(pd.Timestamp('2024-07-05 00:30'), pd.Timestamp('2024-07-05 03:30'), fetcher=fetch) == []
+    history = store.query('2024-07-05 00:00', '2024-07-05 04:00')
+    assert len(history) == 4 * 360 + 1
+    assert history.index.is_unique and history.index.is_monotonic_increasing
+
+def test_duplicated_samples_keep_the_newest_copy(tmp_path):
+    store = HistoryStore(tmp_path / 'store')
+    generate_history(tmp_path / 'first.csv', '2024-07-05 00:00', 100, seed=1)
+    generate_history(tmp_path / 'second.csv', '2024-07-05 00:05', 100, seed=2)
+    store.add(read_mhist(tmp_path / 'first.csv', cache_dir=False))
+    second = read_mhist(tmp_path / 'second.csv', cache_dir=False)
+    store.add(second)
+    history = store.query('2024-07-05 00:00', '2024-07-05 01:00')
+    assert len(history) == 130
+    pd.testing.assert_frame_equal(history.loc[second.index], second, check_freq=False)
+
+def test_days_are_stored_and_read_in_their_own_partition(tmp_path):
+    store = HistoryStore(tmp_path / 'store')
+    generate_history(tmp_path / 'night.csv', '2024-07-05 23:00', 721)
+    store.add(read_mhist(tmp_path / 'night.csv', cache_dir=False))
+    assert sorted(os.listdir(tmp_path / 'store')) == ['2024-07-05.parquet', '2024-07-06.parquet', 'coverage.json']
+    os.remove(store.partition_path('2024-07-05'))
+    history = store.query('2024-07-06 00:00', '2024-07-06 00:30')
+    assert len(history) == 181
+    assert history.index.min() == pd.Timestamp('2024-07-06 00:00')
@@ -0,0 +1,62 @@
+import os
+import numpy as np
+import pytest
+from mango_merge.merging import split_job
+
+def write_sized_files(folder, sizes):
+    paths = []
+    for i, size in enumerate(sizes):
+        path = os.path.join(folder, f"reco_run{i + 1}_3D.root")
+        with open(path, 'wb') as f:
+            f.write(b'\0' * size)
+        paths.append(path)
+    return paths
+
+def write_event_files(folder, entries):
+    uproot = pytest.importorskip('uproot')
+    paths = []
+    for i, n_entries in enumerate(entries):
+        path = os.path.join(folder, f"reco_run{i + 1}_3D.root")
+        with uproot.recreate(path) as root_file:
+            tree = root_file.mktree('Events', {'run': np.int32})
+            tree.extend({'run': np.full(n_entries, i + 1, dtype=np.int32)})
+        paths.append(path)
+    return paths
+
+def part_sizes(parts, weights):
+    return [sum(weights[path] for path in input_paths) for target_path, input_paths in parts]
+
+def test_parts_never_exceed_the_byte_cap(tmp_path):
+    paths = write_sized_files(tmp_path, [60, 60, 60, 60])
+    parts = split_job(('target/reco_run1-4_3D.root', paths), max_bytes=100)
+    assert part_sizes(parts, {path: 60 for path in paths}) == [60, 60, 60, 60]
+    assert [target for target, _ in parts] == [f'target/reco_run1-4_3D_part{k}.root' for k in range(1, 5)]
+
+def test_parts_never_exceed_the_entry_cap(tmp_path):
+    paths = write_event_files(tmp_path, [100, 100, 100])
+    parts = split_job(('target/reco_run1-3_3D.root', paths), max_entries=150)
+    assert [input_paths for _, input_paths in parts] == [[path] for path in paths]
+
+def test_inputs_keep_their_order_and_fill_parts(tmp_path):
+    sizes = [30, 40, 50, 20, 10, 90]
+    paths = write_sized_files(tmp_path, sizes)
+    parts = split_job(('target/reco_run1-6_3D.root', paths), max_bytes=100)
+    assert [path for _, input_paths in parts for path in input_paths] == paths
+    assert part_sizes(parts, dict(zip(paths, sizes))) == [70, 80, 90]
+
+def test_parts_are_balanced_under_the_cap(tmp_path):
+    paths = write_sized_files(tmp_path, [10] * 11)
+    parts = split_job(('target/reco_run1-11_3D.root', paths), max_bytes=100)
+    assert [len(input_paths) for _, input_paths in parts] == [6, 5]
+    assert [path for _, input_paths in parts for path in input_paths] == paths
+
+def test_an_input_larger_than_the_cap_gets_its_own_part(tmp_path):
+    paths = write_sized_files(tmp_path, [20, 300, 20])
+    parts = split_job(('target/reco_run1-3_3D.root', paths), max_bytes=100)
+    assert [input_paths for _, input_paths in parts] == [[paths[0]], [paths[1]], [paths[2]]]
+
+def test_small_jobs_are_left_whole(tmp_path):
+    paths = write_sized_files(tmp_path, [20, 30])
+    job = ('target/reco_run1-2_3D.root', paths)
+    assert split_job(job, max_bytes=100) == [job]
+    assert split_job(job) == [job]